@@ -0,0 +1,136 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+
+def alert_key(device, timestamp, risk):
+    """Stable 16-byte key for an alert (unlike hash(), identical in every process)."""
+    return _digest(device, pd.Timestamp(timestamp).isoformat(), risk)
+
+
+def _digest(device, iso_time, risk):
+    return hashlib.blake2b(f"{device}|{iso_time}|{risk}".encode("utf-8"), digest_size=16).digest()
+
+
+class AlertGate:
+    """Decides which detected anomalies become alerts and which are notified.
+
+    An alert is
+      - a duplicate if the same (device, timestamp, risk) was seen within
+        the last `ttl` seconds (the row was scored again on a later run);
+        duplicates are dropped, or
+      - rate limited if the device's token bucket is empty: each device may
+        notify `burst` alerts at once, refilled at `rate` alerts per second.
+        Rate-limited alerts are still recorded, but raise no toast or email,
+        so one ongoing incident cannot flood the screen and the mailbox.
+
+    Seen keys live in a dict ordered by expiry that drops entries `ttl`
+    seconds after they were last seen and never holds more than `max_keys`,
+    so memory stays constant over long monitoring sessions. Keys are stable
+    digests and expiry uses wall clock time, so the state can be saved and
+    loaded across restarts.
+    """
+
+    def __init__(self, ttl=3600.0, max_keys=10_000, rate=1 / 30, burst=5, clock=time.time):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._seen)
+
+    def _expire(self, now):
+        seen = self._seen
+        while seen and next(iter(seen.values())) <= now:
+            seen.popitem(last=False)
+
+    def _remember(self, key, now):
+        self._seen[key] = now + self.ttl
+        self._seen.move_to_end(key)
+        if len(self._seen) > self.max_keys:
+            self._seen.popitem(last=False)
+
+    def _take_token(self, device, now):
+        tokens, last = self._buckets.get(device, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[device] = (tokens, now)
+            return False
+        self._buckets[device] = (tokens - 1, now)
+        return True
+
+    def _check(self, key, device, now):
+        if key in self._seen:
+            reason = "duplicate"
+        elif not self._take_token(device, now):
+            reason = "rate_limited"
+        else:
+            reason = None
+        # Suppressed rows are remembered too (and re-seeing one extends its TTL),
+        # so rescanning the same traffic on later runs never alerts it again
+        self._remember(key, now)
+        return reason
+
+    def check(self, device, timestamp, risk):
+        """Return None if the alert may be raised (and record it), else why it is suppressed."""
+        now = self.clock()
+        key = alert_key(device, timestamp, risk)
+        with self._lock:
+            self._expire(now)
+            reason = self._check(key, device, now)
+        if reason is not None:
+            metrics.inc("alerts_suppressed", reason=reason)
+        return reason
+
+    def check_many(self, devices, timestamps, risks):
+        """Reasons (None, "duplicate" or "rate_limited") for a batch of alerts, decided in order as by `check`.
+
+        Keys are built column-wise and the whole batch is checked under one
+        lock with one clock reading, so a results frame costs a single pass.
+        """
+        devices = list(devices)
+        times = [ts.isoformat() for ts in pd.DatetimeIndex(timestamps)]
+        keys = [_digest(device, iso, risk) for device, iso, risk in zip(devices, times, risks)]
+        now = self.clock()
+        suppressed = {}
+        with self._lock:
+            self._expire(now)
+            reasons = [self._check(key, device, now) for key, device in zip(keys, devices)]
+        for reason in reasons:
+            if reason is not None:
+                suppressed[reason] = suppressed.get(reason, 0) + 1
+        for reason, n in suppressed.items():
+            metrics.inc("alerts_suppressed", n, reason=reason)
+        return reasons
+
+    def allow_many(self, devices, timestamps, risks):
+        """Boolean array: which of these alerts may be raised and notified (see check_many)."""
+        return np.array([reason is None for reason in self.check_many(devices, timestamps, risks)], dtype=bool)
+
+    def allow(self, device, timestamp, risk):
+        """True if an alert for this row should be raised."""
+        return self.check(device, timestamp, risk) is None
+
+    def save(self, path):
+        with open(path, "wb") as fh:
+            pickle.dump({"seen": self._seen, "buckets": self._buckets}, fh)
+
+    @classmethod
+    def load(cls, path, **params):
+        with open(path, "rb") as fh:
+            state = pickle.load(fh)
+        gate = cls(**params)
+        gate._seen, gate._buckets = state["seen"], state["buckets"]
+        return gate
@@ -0,0 +1,311 @@
+import atexit
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+# Where the default store is kept; override with ALERT_DB_PATH
+DEFAULT_PATH = "alerts.db"
+
+# Alert record keys -> SQLite columns
+COLUMNS = {
+    "ID": "id",
+    "Time": "time",
+    "Device": "device",
+    "Packets": "packets",
+    "Risk": "risk",
+    "RiskScore": "risk_score",
+    "Explanation": "explanation",
+    "SHAP_Explanation": "shap_explanation",
+    "Email": "email",
+    "EmailError": "email_error",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY,
+    time TEXT NOT NULL,
+    device TEXT NOT NULL,
+    packets INTEGER,
+    risk TEXT NOT NULL,
+    risk_score REAL,
+    explanation TEXT,
+    shap_explanation TEXT,
+    email TEXT,
+    email_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_time ON alerts (time);
+CREATE INDEX IF NOT EXISTS idx_alerts_device_time ON alerts (device, time);
+CREATE INDEX IF NOT EXISTS idx_alerts_risk_time ON alerts (risk, time);
+CREATE INDEX IF NOT EXISTS idx_alerts_risk_score ON alerts (risk_score);
+CREATE TABLE IF NOT EXISTS alert_minutes (
+    minute TEXT NOT NULL,
+    risk TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (minute, risk)
+);
+CREATE TABLE IF NOT EXISTS alert_devices (
+    device TEXT NOT NULL,
+    risk TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    max_score REAL,
+    last_time TEXT,
+    PRIMARY KEY (device, risk)
+);
+"""
+
+# Fold a batch into the aggregates (rows are pre-aggregated per batch in Python)
+_UPSERT_MINUTES = """
+INSERT INTO alert_minutes (minute, risk, count) VALUES (?, ?, ?)
+ON CONFLICT (minute, risk) DO UPDATE SET count = count + excluded.count
+"""
+_UPSERT_DEVICES = """
+INSERT INTO alert_devices (device, risk, count, max_score, last_time) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (device, risk) DO UPDATE SET
+    count = count + excluded.count,
+    max_score = max(coalesce(max_score, excluded.max_score), coalesce(excluded.max_score, max_score)),
+    last_time = max(last_time, excluded.last_time)
+"""
+_REBUILD_AGGREGATES = """
+DELETE FROM alert_minutes;
+DELETE FROM alert_devices;
+INSERT INTO alert_minutes SELECT substr(time, 1, 16), risk, COUNT(*) FROM alerts GROUP BY 1, 2;
+INSERT INTO alert_devices SELECT device, risk, COUNT(*), MAX(risk_score), MAX(time) FROM alerts GROUP BY 1, 2;
+"""
+
+
+class AlertStore:
+    """Alert history in an indexed SQLite database.
+
+    Records are the alert dicts built by alerting.make_record. `add` assigns
+    each record a permanent ID (stored in record["ID"]) and buffers it; the
+    buffer is written in one transaction once it holds `batch_size` records,
+    and before any query. Times are "YYYY-MM-DD HH:MM:SS" text, so they sort
+    and range-compare correctly, and the indexes on time, (device, time),
+    (risk, time) and risk_score keep range, device and top-N queries fast
+    for millions of alerts.
+
+    Per-minute counts and per-device totals (by risk level) are kept in
+    aggregate tables that every flush updates with just the new batch, so
+    dashboards can chart the whole history without scanning it.
+
+    One connection is shared by every thread (the email worker updates
+    delivery status) and guarded by a lock. Use ":memory:" for a throwaway
+    store.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        if self._conn.execute("SELECT NOT EXISTS (SELECT 1 FROM alert_devices) AND EXISTS (SELECT 1 FROM alerts)").fetchone()[0]:
+            # Store written before the aggregate tables existed
+            with self._conn:
+                self._conn.executescript(_REBUILD_AGGREGATES)
+        self._next_id = (self._conn.execute("SELECT MAX(id) FROM alerts").fetchone()[0] or 0) + 1
+        self._pending = []
+
+    def __len__(self):
+        with self._lock:
+            self.flush()
+            return self._conn.execute("SELECT COUNT(*) FROM alerts").fetchone()[0]
+
+    def add(self, record):
+        """Assign `record` an ID and queue it for the next batched insert; returns the ID."""
+        return self.add_many([record])[0]
+
+    def add_many(self, records):
+        """Add several alert records at once; returns their IDs."""
+        with self._lock:
+            ids = []
+            for record in records:
+                record["ID"] = self._next_id
+                self._next_id += 1
+                ids.append(record["ID"])
+            self._pending.extend(records)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+        return ids
+
+    def flush(self):
+        """Write buffered records to the database in one transaction."""
+        with self._lock:
+            if not self._pending:
+                return
+            rows = [tuple(_sql_value(record.get(key)) for key in COLUMNS) for record in self._pending]
+            minutes, devices = _aggregate(rows)
+            with self._conn:
+                self._conn.executemany(
+                    f"INSERT INTO alerts ({', '.join(COLUMNS.values())}) "
+                    f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                    rows,
+                )
+                self._conn.executemany(_UPSERT_MINUTES, minutes)
+                self._conn.executemany(_UPSERT_DEVICES, devices)
+            self._pending = []
+
+    def update(self, alert_id, **fields):
+        """Update stored fields (record keys, e.g. Email="sent") of one alert."""
+        if not fields:
+            return
+        with self._lock:
+            self.flush()
+            assignments = ", ".join(f"{COLUMNS[key]} = ?" for key in fields)
+            with self._conn:
+                self._conn.execute(f"UPDATE alerts SET {assignments} WHERE id = ?",
+                                   (*map(_sql_value, fields.values()), alert_id))
+
+    def _select(self, sql, params):
+        with self._lock:
+            self.flush()
+            cursor = self._conn.execute(sql, params)
+            rows = cursor.fetchall()
+        df = pd.DataFrame(rows, columns=list(COLUMNS))
+        df["Time"] = pd.to_datetime(df["Time"])
+        return df
+
+    @staticmethod
+    def _where(start=None, end=None, device=None, risk=None):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("time >= ?")
+            params.append(_time_text(start))
+        if end is not None:
+            clauses.append("time < ?")
+            params.append(_time_text(end))
+        if device is not None:
+            clauses.append("device = ?")
+            params.append(device)
+        if risk is not None:
+            risks = [risk] if isinstance(risk, str) else list(risk)
+            clauses.append(f"risk IN ({', '.join('?' * len(risks))})")
+            params.extend(risks)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, start=None, end=None, device=None, risk=None, limit=None, offset=0):
+        """Return alerts in [start, end), optionally for one device / risk level(s), newest first."""
+        where, params = self._where(start, end, device, risk)
+        sql = f"SELECT {', '.join(COLUMNS.values())} FROM alerts{where} ORDER BY time DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        return self._select(sql, params)
+
+    def top(self, n=10, start=None, end=None, device=None, risk=None):
+        """Return the `n` alerts with the highest RiskScore."""
+        where, params = self._where(start, end, device, risk)
+        sql = (f"SELECT {', '.join(COLUMNS.values())} FROM alerts{where} "
+               f"ORDER BY risk_score DESC, id DESC LIMIT ?")
+        return self._select(sql, params + [n])
+
+    def count(self, start=None, end=None, device=None, risk=None):
+        where, params = self._where(start, end, device, risk)
+        with self._lock:
+            self.flush()
+            return self._conn.execute(f"SELECT COUNT(*) FROM alerts{where}", params).fetchone()[0]
+
+    def per_minute(self, start=None, end=None, last=None):
+        """Alert counts per minute (rows) and risk level (columns), oldest first.
+
+        `last` limits the result to the most recent `last` minutes that had
+        alerts, which keeps charts a constant size however long the history.
+        """
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("minute >= ?")
+            params.append(_time_text(start)[:16])
+        if end is not None:
+            clauses.append("minute < ?")
+            params.append(_time_text(end)[:16])
+        with self._lock:
+            self.flush()
+            if last is not None:
+                where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+                cutoff = self._conn.execute(
+                    f"SELECT DISTINCT minute FROM alert_minutes{where} ORDER BY minute DESC LIMIT 1 OFFSET ?",
+                    params + [last - 1],
+                ).fetchone()
+                if cutoff is not None:
+                    clauses.append("minute >= ?")
+                    params.append(cutoff[0])
+            where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+            rows = self._conn.execute(f"SELECT minute, risk, count FROM alert_minutes{where}", params).fetchall()
+        df = pd.DataFrame(rows, columns=["Minute", "Risk", "Count"])
+        counts = df.pivot_table(index="Minute", columns="Risk", values="Count", aggfunc="sum", fill_value=0)
+        counts.index = pd.to_datetime(counts.index)
+        counts.columns.name = None
+        return counts.sort_index()
+
+    def device_totals(self):
+        """Per-device alert counts by risk level plus Total, MaxRiskScore and LastAlert."""
+        with self._lock:
+            self.flush()
+            rows = self._conn.execute("SELECT device, risk, count, max_score, last_time FROM alert_devices").fetchall()
+        df = pd.DataFrame(rows, columns=["Device", "Risk", "Count", "MaxRiskScore", "LastAlert"])
+        totals = df.pivot_table(index="Device", columns="Risk", values="Count", aggfunc="sum", fill_value=0)
+        totals.columns.name = None
+        totals["Total"] = totals.sum(axis=1)
+        grouped = df.groupby("Device")
+        totals["MaxRiskScore"] = grouped["MaxRiskScore"].max()
+        totals["LastAlert"] = pd.to_datetime(grouped["LastAlert"].max())
+        return totals.sort_values("Total", ascending=False)
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+
+def _aggregate(rows):
+    """Per-(minute, risk) and per-(device, risk) upsert rows for a batch of alert rows."""
+    names = list(COLUMNS)
+    time_i, device_i, risk_i, score_i = (names.index(k) for k in ("Time", "Device", "Risk", "RiskScore"))
+    minutes, devices = {}, {}
+    for row in rows:
+        key = (str(row[time_i])[:16], row[risk_i])
+        minutes[key] = minutes.get(key, 0) + 1
+        key = (row[device_i], row[risk_i])
+        count, score, last = devices.get(key, (0, None, None))
+        new_score = row[score_i]
+        if score is None or (new_score is not None and new_score > score):
+            score = new_score
+        last = row[time_i] if last is None or row[time_i] > last else last
+        devices[key] = (count + 1, score, last)
+    return (
+        [(minute, risk, n) for (minute, risk), n in minutes.items()],
+        [(device, risk, n, score, last) for (device, risk), (n, score, last) in devices.items()],
+    )
+
+
+def _sql_value(value):
+    # NumPy scalars (e.g. a float32 RiskScore taken from a results row) -> Python numbers;
+    # going through str keeps float32 72.3 as 72.3 rather than 72.30000305
+    if isinstance(value, np.floating):
+        return float(str(value))
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _time_text(value):
+    return pd.Timestamp(value).strftime("%Y-%m-%d %H:%M:%S")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_alert_store():
+    """Return the process-wide alert store, opening it on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = AlertStore(os.getenv("ALERT_DB_PATH", DEFAULT_PATH))
+            atexit.register(_store.flush)
+    return _store
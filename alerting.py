@@ -0,0 +1,586 @@
+"""Headless alerting core: alert records, SMTP settings and email delivery.
+
+Nothing here imports Streamlit, so workers, scripts and tests can raise and
+deliver alerts without the dashboard. `alerts` wraps these helpers with the
+Streamlit UI (session-state alert log, toasts and troubleshooting hints).
+"""
+
+import os
+import queue
+import smtplib
+import ssl
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import ExitStack
+from datetime import datetime
+from email.message import EmailMessage
+from types import MappingProxyType
+
+import numpy as np
+
+import metrics
+
+# Public exports
+__all__ = [
+    "make_record", "make_records", "resolve_smtp_config", "recipients", "build_message", "send_email", "check_smtp_connection",
+    "SMTPSession", "get_session", "close_sessions", "AlertDigest", "make_digest", "AlertQueue", "get_alert_queue",
+]
+
+SMTP_KEYS = ("SMTP_HOST", "SMTP_PORT", "SMTP_USER", "SMTP_PASSWORD", "ALERT_TO")
+
+
+def make_record(device, packets, risk, risk_score=None, explanation=None, shap_explanation=None, timestamp=None):
+    """Return the alert record dict stored in the alert log."""
+    if timestamp is None:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return {
+        "Time": timestamp,
+        "Device": device,
+        "Packets": int(packets),
+        "Risk": risk,
+        # RiskScore is computed to one decimal; rounding drops float32 noise (72.30000305)
+        "RiskScore": None if risk_score is None else round(float(risk_score), 1),
+        "Explanation": explanation,
+        "SHAP_Explanation": shap_explanation
+    }
+
+
+def make_records(results, timestamp=None):
+    """Alert records for every row of a detection results frame, in row order.
+
+    Column-wise equivalent of calling make_record per row: columns are
+    converted once rather than read row by row. Missing RiskScore,
+    Explanation or SHAP_Explanation columns give None fields.
+    """
+    if timestamp is None:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    n = len(results)
+
+    def column(name):
+        return results[name].tolist() if name in results.columns else [None] * n
+
+    scores = [None] * n
+    if "RiskScore" in results.columns:
+        values = results["RiskScore"].to_numpy(dtype=float, na_value=np.nan).round(1)
+        scores = [None if np.isnan(v) else v for v in values.tolist()]
+    rows = zip(results["Device"].tolist(), results["Packets"].to_numpy(dtype=np.int64).tolist(),
+               results["Risk"].tolist(), scores, column("Explanation"), column("SHAP_Explanation"))
+    return [
+        {
+            "Time": timestamp,
+            "Device": device,
+            "Packets": packets,
+            "Risk": risk,
+            "RiskScore": score,
+            "Explanation": explanation,
+            "SHAP_Explanation": shap_explanation,
+        }
+        for device, packets, risk, score, explanation, shap_explanation in rows
+    ]
+
+
+def _port(value, default=587):
+    try:
+        port = int(value or default)
+    except (TypeError, ValueError):
+        return default
+    return port if 0 < port < 65536 else default
+
+
+def _parse_recipients(alert_to):
+    return tuple(addr.strip() for addr in (alert_to or "").split(",") if addr.strip())
+
+
+def resolve_smtp_config(session_config=None, secrets=None, environ=None):
+    """Return the validated SMTP settings, or None if no SMTP host is configured.
+
+    Sources are tried in order: settings saved from the dashboard sidebar
+    (`session_config`), Streamlit secrets (`secrets`, any mapping with .get)
+    and finally the SMTP_* / ALERT_TO environment variables.
+
+    The result is a read-only mapping with the SMTP_* / ALERT_TO keys, the
+    port already converted to int and the parsed addresses under RECIPIENTS,
+    so it can be resolved once and shared by every alert.
+    """
+    environ = os.environ if environ is None else environ
+    source = None
+    if session_config:
+        source = session_config
+    elif secrets is not None:
+        try:
+            if secrets.get("SMTP_HOST") or secrets.get("ALERT_TO"):
+                source = secrets
+        except Exception:
+            source = None
+    if source is None:
+        if not environ.get("SMTP_HOST"):
+            return None
+        source = environ
+
+    cfg = {key: source.get(key) for key in SMTP_KEYS}
+    for key in ("SMTP_HOST", "SMTP_USER", "ALERT_TO"):
+        cfg[key] = (str(cfg[key]).strip() or None) if cfg[key] is not None else None
+    if not cfg["SMTP_HOST"]:
+        return None
+    cfg["SMTP_PORT"] = _port(cfg["SMTP_PORT"])
+    cfg["RECIPIENTS"] = _parse_recipients(cfg["ALERT_TO"])
+    return MappingProxyType(cfg)
+
+
+def recipients(cfg):
+    """Return the list of addresses in the config's comma-separated ALERT_TO."""
+    if "RECIPIENTS" in cfg:
+        return list(cfg["RECIPIENTS"])
+    return list(_parse_recipients(cfg.get("ALERT_TO")))
+
+
+def build_message(cfg, record):
+    """Build the EmailMessage for an alert record (or a digest record from AlertDigest)."""
+    if record.get("Digest"):
+        return _build_digest_message(cfg, record)
+    risk, device = record["Risk"], record["Device"]
+    body_lines = [
+        f"Time: {record['Time']}",
+        f"Device: {device}",
+        f"Packets: {record['Packets']}",
+        f"Risk: {risk}",
+    ]
+    if record.get("RiskScore") is not None:
+        body_lines.append(f"RiskScore: {record['RiskScore']}")
+    if record.get("Explanation"):
+        body_lines.append(f"Explanation: {record['Explanation']}")
+    if record.get("SHAP_Explanation"):
+        body_lines.append(f"Feature Importance (SHAP): {record['SHAP_Explanation']}")
+
+    body_lines.append("")
+    body_lines.append("This is an automated alert from Smart Home Intrusion Detector.")
+
+    msg = EmailMessage()
+    msg["From"] = cfg.get("SMTP_USER") or f"alerts@{cfg['SMTP_HOST']}"
+    msg["To"] = ", ".join(recipients(cfg))
+    msg["Subject"] = f"[{risk}] Intrusion alert — {device}"
+    msg.set_content("\n".join(body_lines))
+    return msg
+
+
+def _build_digest_message(cfg, digest):
+    alerts = digest["Digest"]
+    risk, group = digest["Risk"], digest["Device"]
+    body_lines = [
+        f"{len(alerts)} {risk} alerts for {group} between {digest['Time']}.",
+        f"Highest RiskScore: {digest['RiskScore']}",
+        "",
+    ]
+    for alert in alerts:
+        line = f"{alert['Time']}  {alert['Device']}  Packets: {alert['Packets']}"
+        if alert.get("RiskScore") is not None:
+            line += f"  RiskScore: {alert['RiskScore']}"
+        if alert.get("Explanation"):
+            line += f"  ({alert['Explanation']})"
+        body_lines.append(line)
+
+    body_lines.append("")
+    body_lines.append("This is an automated alert digest from Smart Home Intrusion Detector.")
+
+    msg = EmailMessage()
+    msg["From"] = cfg.get("SMTP_USER") or f"alerts@{cfg['SMTP_HOST']}"
+    msg["To"] = ", ".join(recipients(cfg))
+    msg["Subject"] = f"[{risk}] Intrusion digest — {len(alerts)} alerts on {group}"
+    msg.set_content("\n".join(body_lines))
+    return msg
+
+
+_tls_context = None
+
+
+def tls_context():
+    """Return the shared client TLS context (building one is costly, so it is made once)."""
+    global _tls_context
+    if _tls_context is None:
+        _tls_context = ssl.create_default_context()
+    return _tls_context
+
+
+class SMTPSession:
+    """A long-lived, authenticated SMTP connection reused across alerts.
+
+    The connection (TCP, STARTTLS and login) is opened on first use and kept
+    open between messages. If it has been idle for more than `noop_after`
+    seconds, a NOOP checks it is still alive first. A connection the server
+    has dropped is reopened transparently, and a send that fails on a stale
+    connection is retried once on a fresh one. Calls are serialised with a
+    lock, so one session can be shared by the UI and the email worker.
+    """
+
+    def __init__(self, cfg, timeout=10, noop_after=30.0):
+        self.cfg = cfg
+        self.timeout = timeout
+        self.noop_after = noop_after
+        self._lock = threading.Lock()
+        self._stack = None
+        self._server = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        self._close()
+        stack = ExitStack()
+        server = stack.enter_context(smtplib.SMTP(self.cfg["SMTP_HOST"], self.cfg["SMTP_PORT"], timeout=self.timeout))
+        try:
+            server.starttls(context=tls_context())
+            if self.cfg.get("SMTP_USER") and self.cfg.get("SMTP_PASSWORD"):
+                server.login(self.cfg["SMTP_USER"], self.cfg["SMTP_PASSWORD"])
+        except BaseException:
+            stack.close()
+            raise
+        metrics.inc("smtp_connects")
+        self._stack, self._server = stack, server
+        return server
+
+    def _alive(self):
+        try:
+            return self._server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _connection(self):
+        if self._server is None:
+            return self._connect()
+        if time.monotonic() - self._last_used > self.noop_after and not self._alive():
+            return self._connect()
+        return self._server
+
+    def send(self, msg):
+        """Send `msg`, reconnecting once if the pooled connection turns out to be stale."""
+        with self._lock:
+            reused = self._server is not None
+            server = self._connection()
+            try:
+                server.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                if not reused:
+                    self._close()
+                    raise
+                self._connect().send_message(msg)
+            self._last_used = time.monotonic()
+
+    def check(self):
+        """Make sure the session is connected and authenticated (NOOP if already open)."""
+        with self._lock:
+            if self._server is None or not self._alive():
+                self._connect()
+            self._last_used = time.monotonic()
+
+    def close(self):
+        """Close the connection, waiting for a send or check in progress to finish."""
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        stack, self._stack, self._server = self._stack, None, None
+        if stack is not None:
+            try:
+                stack.close()  # QUIT, then close the socket
+            except (smtplib.SMTPException, OSError):
+                pass
+
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+# Sessions kept open at once; older ones (e.g. from replaced settings) are closed
+MAX_SESSIONS = 4
+
+
+def get_session(cfg):
+    """Return the pooled SMTPSession for these SMTP settings, creating it on first use."""
+    key = (cfg["SMTP_HOST"], cfg["SMTP_PORT"], cfg.get("SMTP_USER"), cfg.get("SMTP_PASSWORD"))
+    evicted = []
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = SMTPSession(cfg)
+            while len(_sessions) > MAX_SESSIONS:
+                evicted.append(_sessions.popitem(last=False)[1])
+        _sessions.move_to_end(key)
+    # Closed outside the pool lock: close() waits for any send still using the session
+    for old in evicted:
+        old.close()
+    return session
+
+
+def close_sessions():
+    """Close every pooled SMTP connection."""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+def send_email(cfg, record):
+    """Email an alert record over the pooled session; SMTP and network errors propagate."""
+    msg = build_message(cfg, record)
+    session = get_session(cfg)
+    try:
+        with metrics.timer("smtp"):
+            session.send(msg)
+    except Exception:
+        session.close()
+        raise
+    metrics.inc("emails_sent")
+
+
+def check_smtp_connection(cfg):
+    """Open (or health-check) the pooled session for `cfg`; return (ok, message)."""
+    if not cfg or not cfg.get("SMTP_HOST"):
+        return False, 'No SMTP host configured (set via sidebar, secrets, or env vars)'
+    smtp_host, smtp_port = cfg["SMTP_HOST"], cfg["SMTP_PORT"]
+    try:
+        get_session(cfg).check()
+        return True, f'Connected to {smtp_host}:{smtp_port}'
+    except Exception as e:
+        return False, f'Failed to connect to {smtp_host}:{smtp_port} — {e}'
+
+
+def is_permanent_error(exc):
+    """True for SMTP failures that retrying cannot fix (bad credentials, rejected recipients, 5xx)."""
+    if isinstance(exc, (smtplib.SMTPAuthenticationError, smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)):
+        return True
+    return isinstance(exc, smtplib.SMTPResponseException) and exc.smtp_code >= 500
+
+
+class AlertDigest:
+    """Coalesces bursts of alerts into one summary email per window.
+
+    Alerts are grouped by (risk level, device group) and collected for
+    `window` seconds from the first alert of the group, then released as one
+    digest record whose "Digest" field holds the individual alerts. Risk
+    levels in `bypass` (HIGH by default) are never held back. Device groups
+    work like ShardedDetector.shard_by: by default every device is its own
+    group, and `group_by` (a dict or a callable) can map device names to a
+    shared group, e.g. all cameras.
+    """
+
+    def __init__(self, window=300.0, group_by=None, bypass=("HIGH",)):
+        self.window = window
+        self.group_by = group_by
+        self.bypass = tuple(bypass)
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(records) for _, _, records in self._pending.values())
+
+    def group(self, device):
+        if self.group_by is None:
+            return device
+        if isinstance(self.group_by, dict):
+            return self.group_by.get(device, device)
+        return self.group_by(device)
+
+    def add(self, cfg, record, now=None):
+        """Hold `record` for the next digest; return False if its risk level bypasses digests."""
+        if record["Risk"] in self.bypass:
+            return False
+        now = time.monotonic() if now is None else now
+        key = (record["Risk"], self.group(record["Device"]))
+        record["Email"] = "digest"
+        with self._lock:
+            self._pending.setdefault(key, (now, cfg, []))[2].append(record)
+        return True
+
+    def wait_time(self, now=None):
+        """Seconds until the next digest is due (None if nothing is pending)."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if not self._pending:
+                return None
+            return max(0.0, min(start for start, _, _ in self._pending.values()) + self.window - now)
+
+    def pop_due(self, now=None, force=False):
+        """Return (cfg, digest record) for every group whose window has ended (all if `force`)."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            due = [key for key, (start, _, _) in self._pending.items() if force or now - start >= self.window]
+            entries = [(key, self._pending.pop(key)) for key in due]
+        return [(cfg, make_digest(risk, group, records)) for (risk, group), (_, cfg, records) in entries]
+
+
+def make_digest(risk, group, records):
+    """Return a digest record summarising `records` (see AlertDigest)."""
+    scores = [r["RiskScore"] for r in records if r.get("RiskScore") is not None]
+    return {
+        "Time": f"{records[0]['Time']} and {records[-1]['Time']}",
+        "Device": group,
+        "Packets": sum(r["Packets"] for r in records),
+        "Risk": risk,
+        "RiskScore": max(scores) if scores else None,
+        "Explanation": f"{len(records)} alerts",
+        "SHAP_Explanation": None,
+        "Digest": records,
+    }
+
+
+class AlertQueue:
+    """Bounded queue of outgoing alert emails drained by a background thread.
+
+    `submit` only enqueues, so raising an alert never waits on SMTP. The
+    worker thread (started on first submit) sends each email with `send`
+    (default send_email), retrying transient failures up to `max_retries`
+    times with exponential backoff (`backoff`, 2 * `backoff`, ... capped at
+    `max_backoff` seconds). Permanent failures such as bad credentials are
+    not retried.
+
+    Delivery progress is written to the record itself: record["Email"] moves
+    through queued -> sending (-> retrying) -> sent / failed, with the error
+    text in record["EmailError"]. A full queue drops the email (status
+    "dropped") rather than blocking. Finished deliveries are also kept as
+    events for `pop_events`, so the dashboard can report them on its next run.
+
+    `on_status`, if set, is called with each record whose status changes
+    (e.g. to persist it in the alert store).
+
+    With an AlertDigest as `digest`, alerts it accepts wait (status "digest")
+    and the worker sends one summary email per group when its window ends;
+    the summary's status is copied to every alert in it.
+    """
+
+    def __init__(self, maxsize=100, max_retries=3, backoff=1.0, max_backoff=30.0, send=None, digest=None,
+                 on_status=None):
+        self.digest = digest
+        self.on_status = on_status
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._send = send or send_email
+        self._queue = queue.Queue(maxsize)
+        self._events = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.counts = Counter()
+
+    def __len__(self):
+        return self._queue.unfinished_tasks + (len(self.digest) if self.digest is not None else 0)
+
+    def _set(self, record, status, error=None):
+        for member in [record] + record.get("Digest", []):
+            member["Email"] = status
+            if error is not None:
+                member["EmailError"] = error
+            if self.on_status is not None and "Digest" not in member:
+                self.on_status(member)
+        with self._lock:
+            self.counts[status] += 1
+            if status in ("sent", "failed", "dropped"):
+                self._events.append(record)
+
+    def submit(self, cfg, record):
+        """Queue `record` for delivery with `cfg`; return False if the queue is full."""
+        if self.digest is not None and self.digest.add(cfg, record):
+            self._start()
+            return True
+        if not self._put(cfg, record):
+            return False
+        self._start()
+        return True
+
+    def _put(self, cfg, record):
+        record["Email"] = "queued"
+        try:
+            self._queue.put_nowait((cfg, record))
+        except queue.Full:
+            metrics.inc("emails_dropped")
+            self._set(record, "dropped", "alert queue full")
+            return False
+        return True
+
+    def flush_digests(self):
+        """Queue every pending digest now instead of waiting for its window to end."""
+        if self.digest is not None:
+            for cfg, digest in self.digest.pop_due(force=True):
+                self._put(cfg, digest)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="alert-email", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self.digest is not None:
+                for cfg, digest in self.digest.pop_due():
+                    metrics.inc("email_digests")
+                    self._put(cfg, digest)
+                # Wake up in time for the oldest pending digest; a digest started while
+                # blocked here is never due before this (a full window) elapses
+                timeout = self.digest.wait_time()
+                if timeout is None:
+                    timeout = self.digest.window
+            try:
+                cfg, record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            try:
+                self._deliver(cfg, record)
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, cfg, record):
+        for attempt in range(self.max_retries + 1):
+            record["Email"] = "sending"
+            try:
+                self._send(cfg, record)
+            except Exception as e:
+                if is_permanent_error(e) or attempt == self.max_retries:
+                    metrics.inc("emails_failed")
+                    self._set(record, "failed", f"{type(e).__name__}: {e}")
+                    return
+                metrics.inc("email_retries")
+                self._set(record, "retrying", str(e))
+                time.sleep(min(self.backoff * 2 ** attempt, self.max_backoff))
+            else:
+                self._set(record, "sent")
+                return
+
+    def join(self, timeout=None):
+        """Wait until every queued email has been delivered or given up on (digests still pending excluded)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def pop_events(self):
+        """Return the records whose delivery finished since the last call."""
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+
+_alert_queue = None
+
+
+def get_alert_queue():
+    """Return the process-wide AlertQueue, or None if ALERT_QUEUE_SIZE=0 (send inline).
+
+    ALERT_DIGEST_WINDOW (seconds, default 0 = off) turns on digest mode and
+    ALERT_DIGEST_BYPASS (comma-separated risk levels, default HIGH) lists the
+    alerts that are still emailed immediately.
+    """
+    global _alert_queue
+    size = int(os.getenv("ALERT_QUEUE_SIZE", "100"))
+    if size <= 0:
+        return None
+    if _alert_queue is None:
+        digest = None
+        window = float(os.getenv("ALERT_DIGEST_WINDOW", "0"))
+        if window > 0:
+            bypass = [level.strip() for level in os.getenv("ALERT_DIGEST_BYPASS", "HIGH").split(",") if level.strip()]
+            digest = AlertDigest(window=window, bypass=bypass)
+        _alert_queue = AlertQueue(maxsize=size, digest=digest)
+    return _alert_queue
@@ -1,207 +1,343 @@
-import streamlit as st
-import pandas as pd
-from datetime import datetime
+"""Streamlit alert UI: raising alerts, toasts and the alert dashboard.
+
+Record building and email delivery live in the headless `alerting` module
+and the alert history in `alert_store`.
+"""
+
 import os
 import smtplib
-import ssl
-from email.message import EmailMessage
 
-# Public exports
-__all__ = ["send_alert", "show_alert_dashboard"]
+import numpy as np
+import streamlit as st
 
-def send_alert(device, packets, risk, risk_score=None, explanation=None, shap_explanation=None):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+import alerting
+import metrics
+from alert_store import get_alert_store
 
-    if "alerts" not in st.session_state:
-        st.session_state.alerts = []
+# Public exports
+__all__ = ["send_alert", "dispatch", "update_alert", "show_alert_dashboard"]
+
+RISK_LEVELS = ("LOW", "MEDIUM", "HIGH")
+# Dashboard sizes: table page sizes, top alerts with details, minutes charted
+PAGE_SIZES = (25, 50, 100)
+TOP_N = 10
+CHART_MINUTES = 240
+
+AUTH_HELP = (
+    "**Fix authentication:**\n"
+    "- Gmail: Use App Password, not account password\n"
+    "- Verify User and Password are correct\n"
+    "- Check SMTP Port matches auth method (587 for TLS)"
+)
+NETWORK_HELP = (
+    "**Troubleshooting DNS Error:**\n"
+    "1. Check hostname spelling (e.g., 'smtp.gmail.com' not 'gmail.com')\n"
+    "2. Test with Gmail: Use 'smtp.gmail.com:587' + App Password\n"
+    "3. Try local debug SMTP server:\n"
+    "   - Run: `python -m smtpd -n -c DebuggingServer localhost:1025`\n"
+    "   - Set SMTP Host: 'localhost', Port: '1025'\n"
+    "   - Emails will print to console, not send\n"
+    "4. Check firewall/network blocks port 587 (SMTP)\n"
+    "5. Verify internet connection"
+)
 
-    st.session_state.alerts.append({
-        "Time": timestamp,
-        "Device": device,
-        "Packets": int(packets),
-        "Risk": risk,
-        "RiskScore": risk_score,
-        "Explanation": explanation,
-        "SHAP_Explanation": shap_explanation
-    })
+def send_alert(device, packets, risk, risk_score=None, explanation=None, shap_explanation=None):
+    record = alerting.make_record(device, packets, risk, risk_score, explanation, shap_explanation)
+    get_alert_store().add(record)
+    metrics.inc("alerts_raised", risk=risk)
 
     if risk == "HIGH":
         st.error(f"🚨 HIGH RISK intrusion on {device}")
-        _maybe_send_email(device, packets, risk, timestamp, risk_score, explanation, shap_explanation)
+        _queue_email(record)
     elif risk == "MEDIUM":
         st.warning(f"⚠️ Suspicious activity on {device}")
-        _maybe_send_email(device, packets, risk, timestamp, risk_score, explanation, shap_explanation)
+        _queue_email(record)
     else:
         st.info(f"ℹ️ Unusual activity on {device}")
 
+    # Returned so callers can fill in fields computed later (e.g. SHAP)
+    return record
+
+
+def dispatch(results, gate=None):
+    """Raise alerts for every MEDIUM/HIGH row of a detection results frame.
+
+    The frame is filtered, checked against `gate` (an AlertGate) and turned
+    into alert records column-wise, and the records are stored in one batch.
+    Duplicates are dropped; alerts over a device's rate limit are stored
+    but not emailed or included in the single summary notification shown
+    for the whole frame. Returns {row position in `results`: alert record}
+    for every alert stored; positions rather than index labels, which need
+    not be unique.
+    """
+    positions = np.flatnonzero((results["Risk"] != "LOW").to_numpy())
+    if not len(positions):
+        return {}
+    candidates = results.iloc[positions]
+    notify = np.ones(len(candidates), dtype=bool)
+    if gate is not None:
+        reasons = gate.check_many(candidates["Device"], candidates["Timestamp"], candidates["Risk"])
+        keep = np.array([reason != "duplicate" for reason in reasons], dtype=bool)
+        notify = np.array([reason is None for reason in reasons], dtype=bool)[keep]
+        positions, candidates = positions[keep], candidates[keep]
+        if candidates.empty:
+            return {}
+
+    records = alerting.make_records(candidates)
+    get_alert_store().add_many(records)
+    # Risk and Device are categoricals; count as text so unobserved categories are left out
+    for risk, n in candidates["Risk"].astype(str).value_counts().items():
+        metrics.inc("alerts_raised", int(n), risk=risk)
+
+    notified = candidates[notify]
+    limited = len(candidates) - len(notified)
+    if notified.empty:
+        st.caption(f"🔕 {limited} rate-limited alert(s) recorded without notification")
+    else:
+        counts = notified["Risk"].astype(str).value_counts()
+        devices = notified["Device"].astype(str).value_counts().index.tolist()
+        summary = ", ".join(f"{int(counts[risk])} {risk}" for risk in ("HIGH", "MEDIUM") if risk in counts)
+        on = ", ".join(devices[:3]) + (f" and {len(devices) - 3} more" if len(devices) > 3 else "")
+        if limited:
+            on += f" ({limited} more rate-limited, recorded only)"
+        if "HIGH" in counts:
+            st.error(f"🚨 {summary} risk alert(s) on {on}")
+        else:
+            st.warning(f"⚠️ {summary} risk alert(s) on {on}")
+        _queue_emails([record for record, send in zip(records, notify) if send])
+    return dict(zip(positions.tolist(), records))
+
+
+def update_alert(record, **fields):
+    """Set fields (e.g. SHAP_Explanation) on a raised alert and in the alert store."""
+    record.update(fields)
+    get_alert_store().update(record["ID"], **fields)
+
+
+def _alert_count(totals, device, risk):
+    """Number of alerts matching the dashboard filters, read from the per-device aggregates."""
+    column = "Total" if risk is None else risk
+    if column not in totals.columns:
+        return 0
+    if device is None:
+        return int(totals[column].sum())
+    return int(totals[column].get(device, 0))
+
 
 def show_alert_dashboard():
+    """Render the alert dashboard from precomputed aggregates and one page of alerts.
+
+    Summary figures and charts come from the store's per-minute and
+    per-device aggregates; the table shows a single server-side page and the
+    detail view only the top alerts by RiskScore, so render time does not
+    grow with the size of the alert history.
+    """
     st.subheader("🔔 Intrusion Alert Dashboard")
 
-    if "alerts" not in st.session_state:
+    store = get_alert_store()
+    totals = store.device_totals()
+    if totals.empty:
         st.success("✅ No alerts detected")
         return
 
-    df = pd.DataFrame(st.session_state.alerts)
-    # Normalize Time to datetime if possible
+    _report_deliveries()
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Total alerts", int(totals["Total"].sum()))
+    col2.metric("HIGH", _alert_count(totals, None, "HIGH"))
+    col3.metric("MEDIUM", _alert_count(totals, None, "MEDIUM"))
+    col4.metric("Devices affected", len(totals))
+
+    # Trend: alerts over time (the most recent minutes with alerts)
+    counts = store.per_minute(last=CHART_MINUTES)
+    if not counts.empty:
+        st.line_chart(counts, y_label="Alerts per minute")
+    st.bar_chart(totals[[risk for risk in RISK_LEVELS if risk in totals.columns]], y_label="Alerts per device")
+
+    # Alert log, filtered and paginated by the store
+    col1, col2, col3 = st.columns(3)
+    device = col1.selectbox("Device", ["All"] + list(totals.index), key="alert_filter_device")
+    risk = col2.selectbox("Risk", ["All"] + [r for r in RISK_LEVELS[::-1]], key="alert_filter_risk")
+    page_size = col3.selectbox("Rows per page", PAGE_SIZES, key="alert_page_size")
+    device = None if device == "All" else device
+    risk = None if risk == "All" else risk
+
+    pages = max(1, -(-_alert_count(totals, device, risk) // page_size))
+    # The widget's value lives in session state only (seeded once, clamped when filters shrink the result)
+    if "alert_page" not in st.session_state:
+        st.session_state["alert_page"] = 1
+    elif st.session_state["alert_page"] > pages:
+        st.session_state["alert_page"] = pages
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, key="alert_page")
+    page_df = store.query(device=device, risk=risk, limit=page_size, offset=(page - 1) * page_size)
+    st.dataframe(page_df.drop(columns=["ID"]), use_container_width=True, hide_index=True)
+
+    # Detailed view with SHAP explanations for the top HIGH/MEDIUM alerts
+    st.subheader("📊 Top Alerts & Feature Importance")
+    top = store.top(TOP_N, device=device, risk=risk or ["HIGH", "MEDIUM"])
+    for _, row in top.iterrows():
+        with st.expander(f"Device: {row['Device']} | Risk: {row['Risk']} | Score: {row['RiskScore']}"):
+            col1, col2 = st.columns(2)
+            with col1:
+                st.write(f"**Time:** {row['Time']}")
+                st.write(f"**Packets:** {row['Packets']}")
+                st.write(f"**Risk Score:** {row['RiskScore']}/100")
+            with col2:
+                st.write(f"**Explanation:** {row['Explanation'] or 'N/A'}")
+                st.write(f"**Email:** {row['Email'] or 'not sent'}")
+            if row['SHAP_Explanation']:
+                st.write(f"**Feature Importance (SHAP):** {row['SHAP_Explanation']}")
+
+
+def _secrets_version():
+    """Modification times of the Streamlit secrets files (None for missing files)."""
+    try:
+        paths = st.get_option("secrets.files")
+    except Exception:
+        paths = []
+    version = []
+    for path in paths:
+        try:
+            version.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            version.append(None)
+    return tuple(version)
+
+
+def _smtp_config():
+    """Return the resolved SMTP settings (sidebar, then st.secrets, then env vars).
+
+    Resolution runs once and is cached in the session until the sidebar
+    settings are saved or cleared (see invalidate_smtp_config) or a secrets
+    file changes; environment variables are read once per cache entry.
+    """
+    version = _secrets_version()
+    cached = st.session_state.get("_smtp_config_cache")
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    session_config = st.session_state.get("smtp_config")
+    # Safely attempt to read Streamlit secrets (may raise if no secrets file)
     try:
-        df['Time'] = pd.to_datetime(df['Time'])
+        secrets = getattr(st, "secrets", None)
     except Exception:
-        pass
-
-    st.dataframe(df, use_container_width=True)
-
-    # Trend: alerts over time
-    if 'Time' in df.columns and pd.api.types.is_datetime64_any_dtype(df['Time']):
-        counts = df.set_index('Time').resample('1T').size()
-        if not counts.empty:
-            st.line_chart(counts.rename('Alerts per minute'))
-
-    # Detailed view with SHAP explanations for each HIGH/MEDIUM alert
-    st.subheader("📊 Alert Details & Feature Importance")
-    for idx, row in df.iterrows():
-        if row.get('Risk') in ['HIGH', 'MEDIUM']:
-            with st.expander(f"Device: {row.get('Device')} | Risk: {row.get('Risk')} | Score: {row.get('RiskScore', 'N/A')}"):
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.write(f"**Time:** {row.get('Time')}")
-                    st.write(f"**Packets:** {row.get('Packets')}")
-                    st.write(f"**Risk Score:** {row.get('RiskScore', 'N/A')}/100")
-                with col2:
-                    st.write(f"**Explanation:** {row.get('Explanation', 'N/A')}")
-                    st.write(f"**Cyber Context:** {row.get('CyberContext', 'Unknown')}")
-                if row.get('SHAP_Explanation'):
-                    st.write(f"**Feature Importance (SHAP):** {row.get('SHAP_Explanation')}")
+        secrets = None
+    cfg = alerting.resolve_smtp_config(session_config, secrets)
+    st.session_state["_smtp_config_cache"] = (version, cfg)
+    return cfg
+
+
+def invalidate_smtp_config():
+    """Drop the cached SMTP settings; call after the sidebar settings change."""
+    st.session_state.pop("_smtp_config_cache", None)
+
+
+def _email_config():
+    """Return the SMTP settings if email alerts are configured, warning about bad recipients."""
+    cfg = _smtp_config()
+    if cfg is None:
+        return None
+
+    if not cfg["ALERT_TO"]:
+        st.warning("Email alert configured but `ALERT_TO` not set; skipping email.")
+        return None
+
+    if not cfg["RECIPIENTS"]:
+        st.warning("No valid recipient addresses found in `ALERT_TO`.")
+        return None
+    return cfg
+
+
+def _alert_queue():
+    """The process-wide email queue, persisting delivery status to the alert store."""
+    alert_queue = alerting.get_alert_queue()
+    if alert_queue is not None and alert_queue.on_status is None:
+        alert_queue.on_status = _store_status
+    return alert_queue
+
+
+def _store_status(record):
+    if "ID" in record:
+        get_alert_store().update(record["ID"], Email=record.get("Email"), EmailError=record.get("EmailError"))
+
+
+def _queue_email(record):
+    """Hand a MEDIUM/HIGH alert to the background email queue (or send inline if disabled)."""
+    _queue_emails([record])
+
+
+def _queue_emails(records):
+    """Queue emails for several alerts, resolving the SMTP settings once."""
+    alert_queue = _alert_queue()
+    if alert_queue is None:
+        for record in records:
+            _maybe_send_email(record["Device"], record["Packets"], record["Risk"], record["Time"],
+                              record["RiskScore"], record["Explanation"], record["SHAP_Explanation"])
+        return
+    cfg = _email_config()
+    if cfg is None:
+        return
+    dropped = [record["Device"] for record in records if not alert_queue.submit(cfg, record)]
+    if len(dropped) == 1:
+        st.warning(f"Email queue full; alert for {dropped[0]} was not emailed.")
+    elif dropped:
+        st.warning(f"Email queue full; {len(dropped)} alerts were not emailed.")
+
+
+def _report_deliveries():
+    """Show the outcome of emails delivered in the background since the last run."""
+    alert_queue = _alert_queue()
+    if alert_queue is None:
+        return
+    failed = [r for r in alert_queue.pop_events() if r.get("Email") == "failed"]
+    for record in failed[-3:]:
+        st.error(f"❌ Email alert for {record['Device']} failed: {record.get('EmailError')}")
+    if failed:
+        auth = any(r.get("EmailError", "").startswith("SMTPAuthenticationError") for r in failed)
+        st.info(AUTH_HELP if auth else NETWORK_HELP)
+    counts = alert_queue.counts
+    if counts:
+        st.caption(f"📧 Email delivery: {counts['sent']} sent, {len(alert_queue)} pending, "
+                   f"{counts['failed']} failed, {counts['dropped']} dropped")
 
 
 def _maybe_send_email(device, packets, risk, timestamp, risk_score=None, explanation=None, shap_explanation=None):
-    """Send an email alert if SMTP configuration is present in environment.
+    """Send an email alert right away if SMTP configuration is present.
 
-    Required environment variables:
+    This blocks on SMTP; send_alert uses the background AlertQueue instead
+    unless it is disabled with ALERT_QUEUE_SIZE=0.
+
+    Settings come from the sidebar (session state), Streamlit secrets or the
+    environment variables:
       - SMTP_HOST
       - SMTP_PORT
       - SMTP_USER
       - SMTP_PASSWORD
       - ALERT_TO  (comma-separated recipient emails)
 
-    If `SMTP_HOST` is not set, this function returns silently.
+    If no SMTP host is configured, this function returns silently.
     """
-    # Prefer settings provided in Streamlit session state (set via UI), fall back to env vars
-    smtp_cfg = None
-    try:
-        smtp_cfg = st.session_state.get("smtp_config")
-    except Exception:
-        smtp_cfg = None
-
-    if smtp_cfg:
-        smtp_host = smtp_cfg.get("SMTP_HOST")
-        smtp_port = int(smtp_cfg.get("SMTP_PORT", 587))
-        smtp_user = smtp_cfg.get("SMTP_USER")
-        smtp_password = smtp_cfg.get("SMTP_PASSWORD")
-        alert_to = smtp_cfg.get("ALERT_TO")
-    else:
-        # Check Streamlit secrets next (secure for deployment)
-        # Safely attempt to read Streamlit secrets (may raise if no secrets file)
-        try:
-            secrets = getattr(st, "secrets", None)
-        except Exception:
-            secrets = None
-
-        has_secrets = False
-        smtp_host_secret = None
-        alert_to_secret = None
-        if secrets is not None:
-            try:
-                smtp_host_secret = secrets.get("SMTP_HOST")
-                alert_to_secret = secrets.get("ALERT_TO")
-                has_secrets = bool(smtp_host_secret or alert_to_secret)
-            except Exception:
-                has_secrets = False
-
-        if has_secrets:
-            smtp_host = smtp_host_secret
-            smtp_port = int(secrets.get("SMTP_PORT", 587))
-            smtp_user = secrets.get("SMTP_USER")
-            smtp_password = secrets.get("SMTP_PASSWORD")
-            alert_to = alert_to_secret
-        else:
-            smtp_host = os.getenv("SMTP_HOST")
-            if not smtp_host:
-                return
-            try:
-                smtp_port = int(os.getenv("SMTP_PORT", "587"))
-            except ValueError:
-                smtp_port = 587
-            smtp_user = os.getenv("SMTP_USER")
-            smtp_password = os.getenv("SMTP_PASSWORD")
-            alert_to = os.getenv("ALERT_TO")
-
-    if not alert_to:
-        st.warning("Email alert configured but `ALERT_TO` not set; skipping email.")
+    cfg = _email_config()
+    if cfg is None:
         return
 
-    recipients = [addr.strip() for addr in alert_to.split(",") if addr.strip()]
-    if not recipients:
-        st.warning("No valid recipient addresses found in `ALERT_TO`.")
-        return
-
-    subject = f"[{risk}] Intrusion alert — {device}"
-    body_lines = [
-        f"Time: {timestamp}",
-        f"Device: {device}",
-        f"Packets: {packets}",
-        f"Risk: {risk}",
-    ]
-    if risk_score is not None:
-        body_lines.append(f"RiskScore: {risk_score}")
-    if explanation:
-        body_lines.append(f"Explanation: {explanation}")
-    if shap_explanation:
-        body_lines.append(f"Feature Importance (SHAP): {shap_explanation}")
-
-    body_lines.append("")
-    body_lines.append("This is an automated alert from Smart Home Intrusion Detector.")
-    body = "\n".join(body_lines)
-
-    msg = EmailMessage()
-    msg["From"] = smtp_user or f"alerts@{smtp_host}"
-    msg["To"] = ", ".join(recipients)
-    msg["Subject"] = subject
-    msg.set_content(body)
-
-    context = ssl.create_default_context()
+    record = alerting.make_record(device, packets, risk, risk_score, explanation, shap_explanation, timestamp)
     try:
-        with smtplib.SMTP(smtp_host, smtp_port, timeout=10) as server:
-            server.starttls(context=context)
-            if smtp_user and smtp_password:
-                server.login(smtp_user, smtp_password)
-            server.send_message(msg)
-        st.info(f"Email alert sent to: {', '.join(recipients)}")
+        alerting.send_email(cfg, record)
+        st.info(f"Email alert sent to: {', '.join(alerting.recipients(cfg))}")
+    except smtplib.SMTPAuthenticationError as e:
+        metrics.inc("emails_failed")
+        st.error(f"❌ Authentication failed for {cfg['SMTP_USER']}: {e}")
+        st.info(AUTH_HELP)
+        return False, str(e)
     except OSError as e:
+        metrics.inc("emails_failed")
         # DNS/Network error: getaddrinfo failed, connection refused, etc.
-        st.error(f"❌ Network error sending alert to {smtp_host}:{smtp_port}: {e}")
-        st.info(
-            "**Troubleshooting DNS Error:**\n"
-            "1. Check hostname spelling (e.g., 'smtp.gmail.com' not 'gmail.com')\n"
-            "2. Test with Gmail: Use 'smtp.gmail.com:587' + App Password\n"
-            "3. Try local debug SMTP server:\n"
-            "   - Run: `python -m smtpd -n -c DebuggingServer localhost:1025`\n"
-            "   - Set SMTP Host: 'localhost', Port: '1025'\n"
-            "   - Emails will print to console, not send\n"
-            "4. Check firewall/network blocks port 587 (SMTP)\n"
-            "5. Verify internet connection"
-        )
-        return False, str(e)
-    except smtplib.SMTPAuthenticationError as e:
-        st.error(f"❌ Authentication failed for {smtp_user}: {e}")
-        st.info(
-            "**Fix authentication:**\n"
-            "- Gmail: Use App Password, not account password\n"
-            "- Verify User and Password are correct\n"
-            "- Check SMTP Port matches auth method (587 for TLS)"
-        )
+        st.error(f"❌ Network error sending alert to {cfg['SMTP_HOST']}:{cfg['SMTP_PORT']}: {e}")
+        st.info(NETWORK_HELP)
         return False, str(e)
     except Exception as e:
+        metrics.inc("emails_failed")
         st.error(f"Failed to send email alert: {e}")
         return False, str(e)
     return True, 'OK'
@@ -213,54 +349,4 @@ def test_smtp_connection():
     Uses session_state smtp_config, then st.secrets, then env vars (same as _maybe_send_email).
     This helper is safe to call from the Streamlit app UI.
     """
-    # Reuse the same resolution logic as _maybe_send_email
-    try:
-        cfg = st.session_state.get('smtp_config')
-    except Exception:
-        cfg = None
-
-    if cfg:
-        smtp_host = cfg.get('SMTP_HOST')
-        smtp_port = int(cfg.get('SMTP_PORT') or 587)
-        smtp_user = cfg.get('SMTP_USER')
-        smtp_password = cfg.get('SMTP_PASSWORD')
-    else:
-        try:
-            secrets = getattr(st, 'secrets', None)
-        except Exception:
-            secrets = None
-
-        smtp_host = None
-        smtp_port = 587
-        smtp_user = None
-        smtp_password = None
-        if secrets is not None:
-            try:
-                smtp_host = secrets.get('SMTP_HOST')
-                smtp_port = int(secrets.get('SMTP_PORT', 587))
-                smtp_user = secrets.get('SMTP_USER')
-                smtp_password = secrets.get('SMTP_PASSWORD')
-            except Exception:
-                pass
-
-        if not smtp_host:
-            smtp_host = os.getenv('SMTP_HOST')
-            try:
-                smtp_port = int(os.getenv('SMTP_PORT', smtp_port))
-            except Exception:
-                smtp_port = smtp_port
-            smtp_user = os.getenv('SMTP_USER')
-            smtp_password = os.getenv('SMTP_PASSWORD')
-
-    if not smtp_host:
-        return False, 'No SMTP host configured (set via sidebar, secrets, or env vars)'
-
-    context = ssl.create_default_context()
-    try:
-        with smtplib.SMTP(smtp_host, smtp_port, timeout=10) as server:
-            server.starttls(context=context)
-            if smtp_user and smtp_password:
-                server.login(smtp_user, smtp_password)
-        return True, f'Connected to {smtp_host}:{smtp_port}'
-    except Exception as e:
-        return False, f'Failed to connect to {smtp_host}:{smtp_port} — {e}'
+    return alerting.check_smtp_connection(_smtp_config())
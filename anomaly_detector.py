@@ -1,14 +1,28 @@
-from sklearn.ensemble import IsolationForest
+import os
+import pickle
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
 import pandas as pd
 import numpy as np
 
+from baseline_store import BaselineStore
+from device_registry import get_registry
+from traffic_buffer import TrafficBuffer, to_packets
+import metrics
 
-def detect_anomalies(df, historical_df=None):
-    """Detect anomalies and produce explainable outputs.
 
-    Returns a DataFrame with additional columns:
-      - DeviceID, Anomaly, AnomalyScore (0-1), RiskScore (0-100), Risk (LOW/MEDIUM/HIGH),
-        Explanation (text), CyberContext (mapped scenario), Quarantine
+# Feature columns the isolation forest is trained on
+FEATURES = ['DeviceID', 'Packets', 'Z']
+# Per-shard models see a single device (or device class), so DeviceID is dropped
+SHARD_FEATURES = ['Packets', 'Z']
+
+
+def _prepare_frame(df, registry=None):
+    """Copy `df`, coerce Timestamp to datetime and assign DeviceID codes.
+
+    Device becomes a categorical over the device registry and DeviceID is the
+    device's permanent registry ID, so the same device always gets the same
+    DeviceID no matter which other devices are in the frame.
     """
     df = df.copy()
     # Ensure timestamp dtype
@@ -16,134 +30,797 @@ def detect_anomalies(df, historical_df=None):
         df['Timestamp'] = pd.to_datetime(df['Timestamp'])
 
     # Device codes
-    df['DeviceID'] = df['Device'].astype('category').cat.codes
-
-    # Build baseline stats per device from historical data if available, else from df
-    if historical_df is not None and not historical_df.empty:
-        hist = historical_df.copy()
-        if not np.issubdtype(hist['Timestamp'].dtype, np.datetime64):
-            hist['Timestamp'] = pd.to_datetime(hist['Timestamp'])
-        combined = pd.concat([hist[['Device', 'Packets']], df[['Device', 'Packets']]], ignore_index=True)
-    else:
-        combined = df[['Device', 'Packets']]
+    registry = registry if registry is not None else get_registry()
+    devices = registry.categorical(df['Device'])
+    df['Device'] = devices
+    df['DeviceID'] = devices.codes.astype(np.int32)
+    return df
+
 
-    baseline = combined.groupby('Device')['Packets'].agg(['mean', 'std']).reset_index().rename(columns={'mean': 'BaselineMean', 'std': 'BaselineStd'})
-    df = df.merge(baseline, on='Device', how='left')
-    df['BaselineStd'] = df['BaselineStd'].fillna(0.0)
+def _add_baseline(df, historical_df=None, baseline=None):
+    """Attach BaselineMean, BaselineStd and Z columns to a prepared frame.
+
+    With a BaselineStore the rows of `df` are folded into it and the running
+    per-device statistics are used; otherwise baselines are built from
+    `historical_df` (if given) plus `df`.
+    """
+    if baseline is None:
+        # Build baseline stats per device from historical data if available, else from df
+        baseline = BaselineStore()
+        if historical_df is not None and not historical_df.empty:
+            baseline.update(historical_df)
+    baseline.update(df)
+    return _apply_baseline(df, baseline)
+
+
+def _apply_baseline(df, baseline):
+    """Attach BaselineMean, BaselineStd and Z from `baseline` without updating it."""
+    df['BaselineMean'], df['BaselineStd'] = baseline.lookup(df['DeviceID'])
 
     # Z-score relative to device baseline
     df['Z'] = (df['Packets'] - df['BaselineMean']) / (df['BaselineStd'] + 1e-6)
+    return df
 
-    # Features for isolation forest
-    X = df[['DeviceID', 'Packets', 'Z']]
 
-    model = IsolationForest(contamination=0.05, random_state=42)
-    model.fit(X)
-    df['Anomaly'] = model.predict(X)  # -1 for anomaly, 1 for normal
+def _features(df):
+    """Return the model feature matrix, deriving features if `df` is raw traffic."""
+    if not set(FEATURES).issubset(df.columns):
+        df = _add_baseline(_prepare_frame(df))
+    return df[FEATURES]
+
+
+# Rule-based reasons, one bit each in the packed reason code
+REASONS = (
+    'Unusually high packet transmission',
+    'Sudden deviation from device baseline',
+    'Abnormal traffic compared to other devices',
+    'Anomalous activity during odd hours',
+)
+DEFAULT_EXPLANATION = 'Anomaly detected by model'
+
+RISK_LEVELS = ('LOW', 'MEDIUM', 'HIGH')
+CYBER_CONTEXTS = ('Unknown', 'Possible Botnet Activity', 'Possible DDoS or Flood', 'Potential Unauthorized Access')
+
+# Explanation text for every reason-code combination, indexed by code
+_EXPLANATIONS = [
+    '; '.join(r for bit, r in enumerate(REASONS) if code & (1 << bit)) or DEFAULT_EXPLANATION
+    for code in range(1 << len(REASONS))
+]
+
 
+def _reason_codes(df, packets_99):
+    """Pack the rule-based reasons for every row into a small integer bitmask."""
+    packets = df['Packets'].to_numpy()
+    masks = (
+        packets > (df['BaselineMean'].to_numpy() + 3 * (df['BaselineStd'].to_numpy() + 1e-6)),
+        np.abs(df['Z'].to_numpy()) > 2,
+        # possible DDoS if many devices simultaneously have high packets — flagged later by aggregator
+        packets > packets_99,
+        (df['Timestamp'].dt.hour.to_numpy() < 6) & (df['Anomaly'].to_numpy() == -1),
+    )
+    codes = np.zeros(len(df), dtype=np.uint8)
+    for bit, mask in enumerate(masks):
+        codes |= mask.astype(np.uint8) << bit
+    return codes
+
+
+def _annotate(df, packets_99=None):
+    """Add RiskScore, Risk, Explanation, CyberContext and Quarantine columns.
+
+    All rules are evaluated as column masks and the text columns are built as
+    categoricals over the fixed set of possible strings. `packets_99` is the
+    fleet-wide 99th percentile of Packets used by the cross-device rules; it
+    defaults to the percentile over `df` itself.
+    """
+    if packets_99 is None:
+        packets_99 = df['Packets'].quantile(0.99)
+
+    # Numeric risk score: combine anomaly score and z-score magnitude
+    z_norm = np.tanh(np.abs(df['Z']) / 3.0)  # squash z into 0-1
+    df['RiskScore'] = (0.7 * df['AnomalyScore'] + 0.3 * z_norm) * 100
+    df['RiskScore'] = df['RiskScore'].round(1)
+
+    # Categorical risk (codes index RISK_LEVELS)
+    score = df['RiskScore'].to_numpy()
+    risk = np.select([score >= 70, score >= 40], [2, 1], default=0).astype(np.int8)
+    df['Risk'] = pd.Categorical.from_codes(risk, categories=RISK_LEVELS)
+
+    # Explanation generation
+    df['Explanation'] = pd.Categorical.from_codes(_reason_codes(df, packets_99), categories=_EXPLANATIONS)
+
+    # Map to simple cybersecurity contexts (codes index CYBER_CONTEXTS)
+    packets = df['Packets'].to_numpy()
+    context = np.select(
+        [packets > df['BaselineMean'].to_numpy() * 5, packets > packets_99, risk == 2],
+        [1, 2, 3],
+        default=0,
+    ).astype(np.int8)
+    df['CyberContext'] = pd.Categorical.from_codes(context, categories=CYBER_CONTEXTS)
+
+    # Quarantine decision
+    df['Quarantine'] = pd.Categorical.from_codes((risk == 2).astype(np.int8), categories=['No', 'Yes'])
+
+    # Store numeric outputs compactly; the forest itself works in float32
+    for col in ('BaselineMean', 'BaselineStd', 'Z', 'AnomalyScore', 'RiskScore'):
+        df[col] = df[col].astype(np.float32)
+    df['Anomaly'] = df['Anomaly'].astype(np.int8)
+    if np.issubdtype(df['Packets'].dtype, np.integer):
+        try:
+            df['Packets'] = to_packets(df['Packets'])
+        except ValueError:
+            # Counts beyond int32 keep their dtype rather than wrapping around
+            pass
+    return df
+
+
+def _shap_column(n, explanations=None):
+    """Return SHAP_Explanation as a categorical (nearly every row is empty)."""
+    if explanations is None:
+        return pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=[''])
+    return pd.Categorical(np.asarray(explanations, dtype=object))
+
+
+def compact_traffic(df, registry=None):
+    """Return raw Device/Packets/Timestamp traffic in the compact schema.
+
+    Device becomes a categorical over the device registry and Packets int32,
+    which is how traffic history should be kept in memory. Packets that do
+    not fit int32 raise ValueError (see traffic_buffer.to_packets).
+    """
+    registry = registry if registry is not None else get_registry()
+    df = df.copy()
+    df['Device'] = registry.categorical(df['Device'])
+    df['Packets'] = to_packets(df['Packets'])
+    if not np.issubdtype(df['Timestamp'].dtype, np.datetime64):
+        df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+    return df
+
+
+def memory_per_row(df):
+    """Return the in-memory size of `df` in bytes per row (0 for an empty frame)."""
+    if len(df) == 0:
+        return 0.0
+    return float(df.memory_usage(deep=True).sum()) / len(df)
+
+
+def _fit_model(params, X):
+    """Fit an IsolationForest and return it with its training raw-score range."""
+    # Imported here so the NumPy-only backend runs without scikit-learn installed
+    from sklearn.ensemble import IsolationForest
+
+    model = IsolationForest(**params)
+    model.fit(X)
     # Decision function -> anomaly magnitude (lower -> more anomalous)
+    anomaly_raw = -model.decision_function(X)
+    return model, (float(anomaly_raw.min()), float(anomaly_raw.max()))
+
+
+def _score_model(model, score_range, X):
+    """Return (labels, 0-1 anomaly scores) for `X`, normalised to `score_range`."""
+    # Decision function -> anomaly magnitude (lower -> more anomalous);
+    # IsolationForest.predict is just decision_function < 0, so reuse one pass
     dec = model.decision_function(X)
-    # convert to anomaly score where higher means more anomalous
+    labels = np.where(dec < 0, -1, 1).astype(np.int8)
     anomaly_raw = -dec
-    # normalize 0-1
-    minv, maxv = anomaly_raw.min(), anomaly_raw.max()
+    minv, maxv = score_range
     if maxv - minv <= 0:
-        df['AnomalyScore'] = 0.0
+        scores = np.zeros(len(X))
     else:
-        df['AnomalyScore'] = (anomaly_raw - minv) / (maxv - minv)
+        scores = np.clip((anomaly_raw - minv) / (maxv - minv), 0.0, 1.0)
+    return labels, scores
 
-    # Numeric risk score: combine anomaly score and z-score magnitude
-    z_norm = np.tanh(np.abs(df['Z']) / 3.0)  # squash z into 0-1
-    df['RiskScore'] = (0.7 * df['AnomalyScore'] + 0.3 * z_norm) * 100
-    df['RiskScore'] = df['RiskScore'].round(1)
 
-    # Categorical risk
-    def categorize(score):
-        if score >= 70:
-            return 'HIGH'
-        elif score >= 40:
-            return 'MEDIUM'
-        else:
-            return 'LOW'
+class AnomalyDetector:
+    """IsolationForest detector with separate fit and score paths.
 
-    df['Risk'] = df['RiskScore'].apply(categorize)
+    `fit` trains the forest once on historical traffic and remembers the range
+    of raw anomaly scores seen in training, which `score` uses to normalise new
+    rows to 0-1. Scoring a batch is inference only, so a fitted detector can be
+    kept around (or saved with `save` and restored with `load`) and reused for
+    every incoming batch instead of refitting on each call.
 
-    # Explanation generation
-    explanations = []
-    cyber_contexts = []
-    packets_99 = df['Packets'].quantile(0.99)
-    for _, row in df.iterrows():
-        reasons = []
-        context = 'Unknown'
+    The SHAP explainer for the fitted model is built on first use and cached
+    until the next `fit`.
+    """
 
-        if row['Packets'] > (row['BaselineMean'] + 3 * (row['BaselineStd'] + 1e-6)):
-            reasons.append('Unusually high packet transmission')
+    # explain_anomalies only calls shap_values on detectors that support it
+    supports_shap = True
 
-        if abs(row['Z']) > 2:
-            reasons.append('Sudden deviation from device baseline')
+    def __init__(self, contamination=0.05, random_state=42, **params):
+        self.params = dict(contamination=contamination, random_state=random_state, **params)
+        self.model = None
+        self.score_range = None
+        self.background = None
+        self._explainer = None
 
-        if row['Packets'] > packets_99:
-            reasons.append('Abnormal traffic compared to other devices')
-            # possible DDoS if many devices simultaneously have high packets — flagged later by aggregator
+    @property
+    def is_fitted(self):
+        return self.model is not None
 
-        hour = row['Timestamp'].hour
-        if hour < 6 and row['Anomaly'] == -1:
-            reasons.append('Anomalous activity during odd hours')
+    def needs_fit(self, batch):
+        return not self.is_fitted
 
-        # Map to simple cybersecurity contexts
-        if row['Packets'] > row['BaselineMean'] * 5:
-            context = 'Possible Botnet Activity'
-        elif row['Packets'] > packets_99:
-            context = 'Possible DDoS or Flood'
-        elif row['Risk'] == 'HIGH':
-            context = 'Potential Unauthorized Access'
+    def ensure_fitted(self, historical):
+        """Fit on `historical` unless the detector is already fitted."""
+        if not self.is_fitted:
+            self.fit(historical)
+        return self
 
-        explanations.append('; '.join(reasons) if reasons else 'Anomaly detected by model')
-        cyber_contexts.append(context)
+    def fit(self, historical):
+        """Fit on `historical` traffic (raw or already carrying FEATURES)."""
+        X = _features(historical)
+        self.model, self.score_range = _fit_model(self.params, X)
+        # Small background sample for the model-agnostic SHAP fallback
+        self.background = X.sample(n=min(50, len(X)), random_state=42).to_numpy()
+        self._explainer = None
+        return self
 
-    df['Explanation'] = explanations
-    df['CyberContext'] = cyber_contexts
+    def score(self, batch, update=True):
+        """Return (labels, scores) for `batch`.
 
-    # Quarantine decision
-    df['Quarantine'] = df['Risk'].apply(lambda x: 'Yes' if x == 'HIGH' else 'No')
+        labels are -1 for anomaly and 1 for normal; scores are anomaly scores in
+        0-1 (higher means more anomalous) relative to the training range.
+        `update` is ignored: the forest does not learn from scored rows.
+        """
+        if not self.is_fitted:
+            raise RuntimeError("AnomalyDetector must be fitted before scoring")
+        X = _features(batch)
+        return _score_model(self.model, self.score_range, X)
 
-    # Optional: SHAP-based explanations for top anomalies (best-effort)
-    df['SHAP_Explanation'] = ''
-    try:
-        import shap
+    def explainer(self):
+        """Return the cached SHAP explainer, building it on first use.
+
+        TreeExplainer walks the forest directly and is much cheaper per row;
+        KernelExplainer over the background sample is kept as a fallback.
+        """
+        if self._explainer is None:
+            import shap
 
-        # Use a small background sample
-        bg = X.sample(n=min(50, len(X)), random_state=42).to_numpy()
-        # model function expects array-like -> returns decision_function
-        def model_fn(data_array):
             try:
-                d = pd.DataFrame(data_array, columns=X.columns)
-                return model.decision_function(d)
+                self._explainer = shap.TreeExplainer(self.model)
             except Exception:
-                # fallback shape
-                return np.zeros((data_array.shape[0],))
+                model = self.model
+
+                # model function expects array-like -> returns decision_function
+                def model_fn(data_array):
+                    try:
+                        return model.decision_function(pd.DataFrame(data_array, columns=FEATURES))
+                    except Exception:
+                        # fallback shape
+                        return np.zeros((data_array.shape[0],))
+
+                self._explainer = shap.KernelExplainer(model_fn, self.background)
+        return self._explainer
+
+    def shap_values(self, X):
+        """Return SHAP values (rows x FEATURES) for the feature rows `X`."""
+        import shap
+
+        explainer = self.explainer()
+        if isinstance(explainer, shap.KernelExplainer):
+            # nsamples can be tuned; keep small for speed
+            return explainer.shap_values(X.to_numpy(), nsamples=100, silent=True)
+        return explainer.shap_values(X)
+
+    def save(self, path):
+        with open(path, 'wb') as fh:
+            pickle.dump({
+                'params': self.params,
+                'model': self.model,
+                'score_range': self.score_range,
+                'background': self.background,
+            }, fh)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as fh:
+            state = pickle.load(fh)
+        detector = cls(**state['params'])
+        detector.model = state['model']
+        detector.score_range = state['score_range']
+        detector.background = state.get('background')
+        return detector
+
+
+class ShardedDetector:
+    """Per-device (or per-device-class) IsolationForest shards.
+
+    Instead of one global model that treats DeviceID as a numeric feature,
+    every shard gets its own forest over SHARD_FEATURES. By default each device
+    is its own shard; `shard_by` can map device names to a shared class (a dict
+    or a callable, e.g. all cameras in one shard).
+
+    Shards are fitted in parallel on a process pool of `n_jobs` workers (None
+    uses all cores, 1 fits in-process). `ensure_fitted` only trains shards that
+    have no model yet, so a newly added device costs one shard fit rather than
+    a full retrain. Scoring runs each shard on a thread pool, which keeps the
+    fitted models in this process instead of shipping them to workers on every
+    batch.
+    """
+
+    # Per-shard forests have no single model to explain
+    supports_shap = False
+
+    def __init__(self, shard_by=None, n_jobs=None, registry=None, contamination=0.05, random_state=42, **params):
+        self.params = dict(contamination=contamination, random_state=random_state, **params)
+        self.shard_by = shard_by
+        self.n_jobs = n_jobs
+        self.registry = registry if registry is not None else get_registry()
+        self.models = {}
+
+    @property
+    def is_fitted(self):
+        return bool(self.models)
+
+    def _shard_keys(self, X):
+        ids = X['DeviceID'].to_numpy()
+        if self.shard_by is None:
+            return ids
+        names = self.registry.names
+        uniq, inverse = np.unique(ids, return_inverse=True)
+        if isinstance(self.shard_by, dict):
+            keys = [self.shard_by.get(names[i], names[i]) for i in uniq]
+        else:
+            keys = [self.shard_by(names[i]) for i in uniq]
+        return np.array(keys, dtype=object)[inverse]
+
+    def _groups(self, X):
+        keys = self._shard_keys(X)
+        return pd.Series(np.arange(len(keys))).groupby(keys, sort=False).indices
+
+    def missing_shards(self, batch):
+        return [key for key in self._groups(_features(batch)) if key not in self.models]
+
+    def needs_fit(self, batch):
+        return bool(self.missing_shards(batch))
 
-        explainer = shap.KernelExplainer(model_fn, bg)
+    def ensure_fitted(self, historical):
+        """Fit only the shards in `historical` that have no model yet."""
+        X = _features(historical)
+        missing = [key for key in self._groups(X) if key not in self.models]
+        if missing:
+            self.fit(X, shards=missing)
+        return self
 
+    def fit(self, historical, shards=None):
+        """Fit the given `shards` (default: every shard present) on `historical`."""
+        X = _features(historical)
+        groups = self._groups(X)
+        keys = [key for key in groups if shards is None or key in shards]
+        data = [X[SHARD_FEATURES].iloc[groups[key]] for key in keys]
+        if self.n_jobs == 1 or len(keys) <= 1:
+            fitted = [_fit_model(self.params, part) for part in data]
+        else:
+            with ProcessPoolExecutor(max_workers=self.n_jobs) as pool:
+                fitted = list(pool.map(_fit_model, [self.params] * len(keys), data))
+        self.models.update(zip(keys, fitted))
+        return self
+
+    def score(self, batch, update=True):
+        """Return (labels, scores) for `batch`, each row scored by its own shard.
+
+        `update` is ignored: the shard models do not learn from scored rows.
+        """
+        X = _features(batch)
+        groups = self._groups(X)
+        missing = [key for key in groups if key not in self.models]
+        if missing:
+            raise RuntimeError(f"No fitted shard for {missing}; call ensure_fitted first")
+        labels = np.ones(len(X), dtype=np.int8)
+        scores = np.zeros(len(X))
+
+        def score_group(key):
+            model, score_range = self.models[key]
+            return groups[key], _score_model(model, score_range, X[SHARD_FEATURES].iloc[groups[key]])
+
+        with ThreadPoolExecutor(max_workers=self.n_jobs) as pool:
+            for rows, (shard_labels, shard_scores) in pool.map(score_group, list(groups)):
+                labels[rows] = shard_labels
+                scores[rows] = shard_scores
+        return labels, scores
+
+    def save(self, path):
+        with open(path, 'wb') as fh:
+            pickle.dump({'params': self.params, 'shard_by': self.shard_by, 'models': self.models}, fh)
+
+    @classmethod
+    def load(cls, path, n_jobs=None, registry=None):
+        with open(path, 'rb') as fh:
+            state = pickle.load(fh)
+        detector = cls(shard_by=state['shard_by'], n_jobs=n_jobs, registry=registry, **state['params'])
+        detector.models = state['models']
+        return detector
+
+
+def _group_medians(ids, values, size):
+    """Return the median of `values` per integer id (NaN for ids with no values)."""
+    order = np.lexsort((values, ids))
+    ordered = values[order]
+    counts = np.bincount(ids, minlength=size)
+    starts = np.cumsum(counts) - counts
+    seen = counts > 0
+    lo = starts[seen] + (counts[seen] - 1) // 2
+    hi = starts[seen] + counts[seen] // 2
+    medians = np.full(size, np.nan)
+    medians[seen] = (ordered[lo] + ordered[hi]) / 2
+    return medians
+
+
+class StatisticalDetector:
+    """Pure NumPy detector for gateways that cannot run scikit-learn.
+
+    `fit` stores each device's median and MAD (median absolute deviation) of
+    Packets; `score` computes the robust z-score 0.6745 * (x - median) / MAD
+    and the z-score against an exponentially weighted moving average of the
+    device's traffic, kept in a BaselineStore with decay 1 - `alpha`. Rows
+    whose larger deviation exceeds `threshold` are labelled -1 (3.5 is the
+    usual robust z cut-off) and the 0-1 anomaly score reaches 1 at twice the
+    threshold. Devices unseen in training fall back to the fleet-wide median
+    and MAD.
+
+    With `adapt=True` every scored batch is folded into the EWMA afterwards,
+    so the moving average follows gradual drift while a single burst still
+    stands out. Rows that `fit` has just seeded the EWMA with should be
+    scored with `update=False` so they are not folded in a second time. State
+    is a few arrays per device, so fitting and scoring cost O(rows) with no
+    model to train.
+    """
+
+    # Thresholded statistics, nothing for SHAP to explain
+    supports_shap = False
+
+    def __init__(self, threshold=3.5, alpha=0.1, adapt=True, registry=None):
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1]")
+        self.threshold = threshold
+        self.alpha = alpha
+        self.adapt = adapt
+        self.registry = registry if registry is not None else get_registry()
+        self.median = None
+        self.mad = None
+        self.fleet = None
+        self.ewma = None
+
+    @property
+    def is_fitted(self):
+        return self.median is not None
+
+    def needs_fit(self, batch):
+        return not self.is_fitted
+
+    def ensure_fitted(self, historical):
+        """Fit on `historical` unless the detector is already fitted."""
+        if not self.is_fitted:
+            self.fit(historical)
+        return self
+
+    def fit(self, historical):
+        """Learn per-device median/MAD and seed the EWMA from `historical` traffic."""
+        X = _features(historical)
+        ids = X['DeviceID'].to_numpy(dtype=np.int64)
+        packets = X['Packets'].to_numpy(dtype=float)
+        size = int(ids.max()) + 1 if len(ids) else 0
+        median = _group_medians(ids, packets, size)
+        mad = _group_medians(ids, np.abs(packets - median[ids]), size)
+
+        # Unseen devices and devices with constant traffic use the fleet-wide statistics
+        fleet_median = float(np.median(packets)) if len(packets) else 0.0
+        fleet_mad = float(np.median(np.abs(packets - fleet_median))) if len(packets) else 0.0
+        self.fleet = (fleet_median, fleet_mad if fleet_mad > 0 else 1.0)
+        self.median = np.where(np.isnan(median), self.fleet[0], median)
+        self.mad = np.where(np.isnan(mad) | (mad <= 0), self.fleet[1], mad)
+
+        self.ewma = BaselineStore(decay=1 - self.alpha, registry=self.registry)
+        self.ewma.update(pd.DataFrame({'DeviceID': ids, 'Packets': packets}))
+        return self
+
+    def _robust_stats(self, ids):
+        known = ids < len(self.median)
+        median = np.full(len(ids), self.fleet[0])
+        mad = np.full(len(ids), self.fleet[1])
+        median[known] = self.median[ids[known]]
+        mad[known] = self.mad[ids[known]]
+        return median, mad
+
+    def score(self, batch, update=True):
+        """Return (labels, scores) for `batch` like AnomalyDetector.score.
+
+        With `adapt=True` the batch is then folded into the EWMA, unless
+        `update` is false (e.g. the rows were part of the data just fitted on).
+        """
+        if not self.is_fitted:
+            raise RuntimeError("StatisticalDetector must be fitted before scoring")
+        X = _features(batch)
+        ids = X['DeviceID'].to_numpy(dtype=np.int64)
+        packets = X['Packets'].to_numpy(dtype=float)
+
+        median, mad = self._robust_stats(ids)
+        robust_z = 0.6745 * (packets - median) / mad
+        ewma_mean, ewma_std = self.ewma.lookup(ids)
+        ewma_z = np.nan_to_num((packets - ewma_mean) / (ewma_std + 1e-6), nan=0.0)
+        deviation = np.maximum(np.abs(robust_z), np.abs(ewma_z))
+
+        labels = np.where(deviation > self.threshold, -1, 1).astype(np.int8)
+        scores = np.clip(deviation / (2 * self.threshold), 0.0, 1.0)
+        if self.adapt and update:
+            self.ewma.update(pd.DataFrame({'DeviceID': ids, 'Packets': packets}))
+        return labels, scores
+
+    def save(self, path):
+        with open(path, 'wb') as fh:
+            pickle.dump({
+                'params': {'threshold': self.threshold, 'alpha': self.alpha, 'adapt': self.adapt},
+                'median': self.median,
+                'mad': self.mad,
+                'fleet': self.fleet,
+                'ewma': None if self.ewma is None else self.ewma.state(),
+            }, fh)
+
+    @classmethod
+    def load(cls, path, registry=None):
+        with open(path, 'rb') as fh:
+            state = pickle.load(fh)
+        detector = cls(registry=registry, **state['params'])
+        detector.median, detector.mad, detector.fleet = state['median'], state['mad'], state['fleet']
+        if state['ewma'] is not None:
+            detector.ewma = BaselineStore.from_state(state['ewma'], registry=detector.registry)
+        return detector
+
+
+# Detector backends by name; every backend provides is_fitted, needs_fit,
+# ensure_fitted, fit, score(batch, update=True) -> (labels, 0-1 scores), save
+# and load, plus supports_shap and (if it is true) shap_values
+BACKENDS = {
+    'isolation_forest': AnomalyDetector,
+    'sharded': ShardedDetector,
+    'statistical': StatisticalDetector,
+}
+
+
+def make_detector(backend=None, **params):
+    """Create a detector for `backend` (default: DETECTOR_BACKEND or isolation_forest).
+
+    'statistical' needs only NumPy and suits edge gateways; 'isolation_forest'
+    and 'sharded' need scikit-learn.
+    """
+    backend = backend or os.getenv('DETECTOR_BACKEND', 'isolation_forest')
+    try:
+        cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown detector backend {backend!r}; choose from {sorted(BACKENDS)}") from None
+    return cls(**params)
+
+
+class StreamingDetector:
+    """Continuous detection over a bounded sliding window of recent traffic.
+
+    Micro-batches are fed in with `push`, which returns detection results for
+    the new rows only. The window is a TrafficBuffer keeping the newest
+    `window` rows (optionally further limited to rows younger than `max_age`);
+    it supplies the cross-device percentile used by the rules and the
+    training data for the model. Per-device baselines come from a BaselineStore, so neither
+    latency nor memory grows with how long monitoring has been running.
+
+    The model is fitted on the window at the first push and, if
+    `refit_every` is set, refitted after that many further rows. Existing
+    history can be loaded with `seed` so the first push already has context.
+    """
+
+    def __init__(self, window=1000, max_age=None, detector=None, baseline=None, refit_every=None):
+        self.detector = detector if detector is not None else AnomalyDetector()
+        self.baseline = baseline if baseline is not None else BaselineStore()
+        self.max_age = pd.Timedelta(max_age) if max_age is not None else None
+        self.refit_every = refit_every
+        self._rows_since_fit = 0
+        self._buffer = TrafficBuffer(max_rows=window, registry=self.baseline.registry)
+
+    def window_frame(self):
+        """Return the rows currently held in the window as a DataFrame (a view of the buffer)."""
+        frame = self._buffer.frame()
+        frame.insert(1, 'DeviceID', self._buffer.column('DeviceID'))
+        if self.max_age is not None and not frame.empty:
+            frame = frame[frame['Timestamp'] >= frame['Timestamp'].max() - self.max_age]
+        return frame
+
+    def seed(self, history):
+        """Add past traffic to the baselines and window as context, without scoring it.
+
+        Later pushes then score only their own rows, but against baselines and
+        a window that include `history`.
+        """
+        with metrics.timer('baseline'):
+            history = _prepare_frame(history, self.baseline.registry)
+            self.baseline.update(history)
+        self._buffer.append(history)
+
+    def push(self, batch):
+        """Score a micro-batch of Device/Packets/Timestamp rows and return its results."""
+        with metrics.timer('baseline'):
+            batch = _add_baseline(_prepare_frame(batch, self.baseline.registry), baseline=self.baseline)
+        self._buffer.append(batch)
+        window = self.window_frame()
+
+        self._rows_since_fit += len(batch)
+        refit = self.refit_every and self._rows_since_fit >= self.refit_every
+        # The window fitted on already holds the batch, so scoring must not learn from it again
+        fitted = refit or self.detector.needs_fit(batch[FEATURES])
+        if fitted:
+            train = _apply_baseline(window.copy(), self.baseline)[FEATURES]
+            with metrics.timer('fit'):
+                if refit:
+                    self.detector.fit(train)
+                    self._rows_since_fit = 0
+                else:
+                    self.detector.ensure_fitted(train)
+
+        with metrics.timer('predict'):
+            labels, scores = self.detector.score(batch[FEATURES], update=not fitted)
+        metrics.inc('rows_scored', len(batch))
+        batch['Anomaly'] = labels
+        batch['AnomalyScore'] = scores
+        with metrics.timer('explanation'):
+            batch = _annotate(batch, packets_99=window['Packets'].quantile(0.99))
+        batch['SHAP_Explanation'] = _shap_column(len(batch))
+        return batch
+
+
+def explain_anomalies(df, detector, top_n=10):
+    """Return SHAP_Explanation strings for the `top_n` most anomalous rows of `df`.
+
+    `df` is a detect_anomalies result. The returned Series is aligned with
+    `df` and is empty text for every other row, or for all rows if SHAP is not
+    installed or fails, or the detector does not support it (supports_shap).
+    """
+    explanations = pd.Series('', index=df.index, dtype=object)
+    if not getattr(detector, 'supports_shap', False):
+        return explanations
+    try:
         # Compute SHAP values only for top anomalous rows to save time
-        anomalous_idx = df[df['Anomaly'] == -1].sort_values('AnomalyScore', ascending=False).head(10).index
+        anomalous_idx = df[df['Anomaly'] == -1].sort_values('AnomalyScore', ascending=False).head(top_n).index
         if len(anomalous_idx) > 0:
-            X_subset = X.loc[anomalous_idx].to_numpy()
-            # nsamples can be tuned; keep small for speed
-            shap_vals = explainer.shap_values(X_subset, nsamples=100)
-            feature_names = list(X.columns)
+            with metrics.timer('shap'):
+                shap_vals = detector.shap_values(df.loc[anomalous_idx, FEATURES])
             for i, idx in enumerate(anomalous_idx):
-                vals = shap_vals[i]
-                # pair feature and contribution
-                pairs = list(zip(feature_names, vals))
-                # sort by absolute contribution
-                pairs.sort(key=lambda x: abs(x[1]), reverse=True)
+                # pair feature and contribution, sorted by absolute contribution
+                pairs = sorted(zip(FEATURES, shap_vals[i]), key=lambda x: abs(x[1]), reverse=True)
                 # take top 2 contributors
-                top = pairs[:2]
-                expl_text = ', '.join([f"{name}:{val:.3f}" for name, val in top])
-                df.at[idx, 'SHAP_Explanation'] = expl_text
+                explanations[idx] = ', '.join([f"{name}:{val:.3f}" for name, val in pairs[:2]])
     except Exception:
         # If SHAP is not available or fails, skip without breaking
         pass
+    return explanations
+
+
+_shap_executor = None
+
+
+def explain_anomalies_async(df, detector, top_n=10):
+    """Run explain_anomalies on a background worker and return its Future.
+
+    Lets risk scores and alerts go out immediately; apply the finished Series
+    with `df['SHAP_Explanation'] = future.result()` (or per row) later on.
+    Detectors without SHAP support get an already completed Future.
+    """
+    global _shap_executor
+    if not getattr(detector, 'supports_shap', False):
+        future = Future()
+        future.set_result(pd.Series('', index=df.index, dtype=object))
+        return future
+    if _shap_executor is None:
+        _shap_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shap')
+    return _shap_executor.submit(explain_anomalies, df.copy(), detector, top_n)
+
+
+def detect_anomalies(df, historical_df=None, detector=None, baseline=None, explain=True):
+    """Detect anomalies and produce explainable outputs.
+
+    Returns a DataFrame with additional columns:
+      - DeviceID, Anomaly, AnomalyScore (0-1), RiskScore (0-100), Risk (LOW/MEDIUM/HIGH),
+        Explanation (text), CyberContext (mapped scenario), Quarantine
+
+    If `detector` is a fitted AnomalyDetector it is only used for scoring; an
+    unfitted one is fitted on `df` first so later calls can reuse it. Without a
+    detector a throwaway one is fitted on `df`. Pass a ShardedDetector for
+    per-device models (only shards not seen before are fitted) or a
+    StatisticalDetector to score without scikit-learn; see make_detector.
 
+    `baseline` is an optional BaselineStore holding running per-device
+    statistics; `df` is folded into it, so only new rows should be passed and
+    `historical_df` is not needed.
+
+    With `explain=False` the SHAP step is skipped (SHAP_Explanation is left
+    empty), e.g. to run it later through explain_anomalies_async.
+    """
+    if baseline is not None and historical_df is not None:
+        raise ValueError("Pass either historical_df or a BaselineStore, not both")
+    with metrics.timer('baseline'):
+        df = _add_baseline(_prepare_frame(df), historical_df, baseline)
+
+    # Features for isolation forest
+    X = df[FEATURES]
+
+    if detector is None:
+        detector = AnomalyDetector()
+    # A detector fitted on `df` here must not learn from the same rows again while scoring them
+    fitted = detector.needs_fit(X)
+    with metrics.timer('fit'):
+        detector.ensure_fitted(X)
+    with metrics.timer('predict'):
+        labels, scores = detector.score(X, update=not fitted)
+    metrics.inc('rows_scored', len(df))
+    df['Anomaly'] = labels  # -1 for anomaly, 1 for normal
+    df['AnomalyScore'] = scores
+
+    with metrics.timer('explanation'):
+        df = _annotate(df)
+
+    # Optional: SHAP-based explanations for top anomalies (best-effort)
+    df['SHAP_Explanation'] = _shap_column(len(df), explain_anomalies(df, detector) if explain else None)
+
+    return df
+
+
+def detect_anomalies_batch(frames_by_home, detector=None, explain=False):
+    """Score many households in one vectorized pass.
+
+    `frames_by_home` is either a dict of {home: traffic frame} (the key wins
+    over any Home column in the frames) or a single frame with a Home column;
+    empty input gives an empty result frame. Baselines are computed per
+    (Home, Device) in one grouped pass, one shared detector scores every row
+    at once and the cross-device percentile rule is evaluated per home.
+    Returns one frame with the detect_anomalies columns plus Home.
+
+    `detector` is shared by all homes (fitted on the combined traffic if it is
+    not fitted yet). With `explain=True` SHAP is run for the top anomalies of
+    each home.
+    """
+    if isinstance(frames_by_home, pd.DataFrame):
+        df = frames_by_home.reset_index(drop=True)
+    elif frames_by_home:
+        # The dict key is the home; it replaces any Home column the frames already have
+        frames = {home: frame.drop(columns='Home', errors='ignore') for home, frame in frames_by_home.items()}
+        df = pd.concat(frames, names=['Home', None]).reset_index(level=0).reset_index(drop=True)
+    else:
+        df = pd.DataFrame({
+            'Home': pd.Series(dtype=str),
+            'Device': pd.Series(dtype=str),
+            'Packets': pd.Series(dtype=np.int32),
+            'Timestamp': pd.Series(dtype='datetime64[ns]'),
+        })
+    with metrics.timer('baseline'):
+        df = _prepare_frame(df)
+
+        # Per-home, per-device baselines in a single grouped pass
+        grouped = df.groupby(['Home', 'DeviceID'], sort=False)['Packets']
+        df['BaselineMean'] = grouped.transform('mean')
+        df['BaselineStd'] = grouped.transform('std').fillna(0.0)
+        df['Z'] = (df['Packets'] - df['BaselineMean']) / (df['BaselineStd'] + 1e-6)
+
+    X = df[FEATURES]
+    if detector is None:
+        detector = AnomalyDetector()
+    if len(df):
+        fitted = detector.needs_fit(X)
+        with metrics.timer('fit'):
+            detector.ensure_fitted(X)
+        with metrics.timer('predict'):
+            labels, scores = detector.score(X, update=not fitted)
+    else:
+        # Nothing to score (and nothing to fit the detector on)
+        labels, scores = np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.float32)
+    metrics.inc('rows_scored', len(df))
+    df['Anomaly'] = labels
+    df['AnomalyScore'] = scores
+
+    # Cross-device rules compare against each home's own traffic
+    with metrics.timer('explanation'):
+        packets_99 = df['Home'].map(df.groupby('Home', sort=False)['Packets'].quantile(0.99))
+        df = _annotate(df, packets_99=packets_99.to_numpy(dtype=float))
+
+    shap_text = None
+    if explain:
+        shap_text = pd.concat([explain_anomalies(rows, detector) for _, rows in df.groupby('Home', sort=False)])
+        shap_text = shap_text.reindex(df.index)
+    df['SHAP_Explanation'] = _shap_column(len(df), shap_text)
     return df
+
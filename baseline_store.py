@@ -0,0 +1,134 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from device_registry import get_registry
+
+
+class BaselineStore:
+    """Running per-device packet baselines (mean and standard deviation).
+
+    Each `update` folds only the new rows into the stored statistics using the
+    batched form of Welford's algorithm, so keeping baselines current costs
+    O(new rows) and the raw history never has to be kept around. Statistics
+    are held in arrays indexed by the device's registry ID.
+
+    `decay` (0 < decay <= 1) down-weights older observations exponentially:
+    every new reading for a device multiplies the weight of that device's
+    earlier readings by `decay`. With the default of 1.0 the statistics match
+    a plain mean and sample standard deviation over everything seen so far.
+    """
+
+    def __init__(self, decay=1.0, registry=None):
+        if not 0 < decay <= 1:
+            raise ValueError("decay must be in (0, 1]")
+        self.decay = decay
+        self.registry = registry if registry is not None else get_registry()
+        # Per-device total weight, weighted mean and weighted sum of squared deviations
+        self._weight = np.zeros(0)
+        self._mean = np.zeros(0)
+        self._m2 = np.zeros(0)
+
+    def __len__(self):
+        return int(np.count_nonzero(self._weight))
+
+    def _device_ids(self, df):
+        if 'DeviceID' in df.columns:
+            return df['DeviceID'].to_numpy(dtype=np.int64)
+        return self.registry.ids(df['Device']).astype(np.int64)
+
+    def _grow(self, size):
+        if size > len(self._weight):
+            pad = size - len(self._weight)
+            self._weight = np.concatenate([self._weight, np.zeros(pad)])
+            self._mean = np.concatenate([self._mean, np.zeros(pad)])
+            self._m2 = np.concatenate([self._m2, np.zeros(pad)])
+
+    def update(self, df):
+        """Fold the Device (or DeviceID) / Packets rows of `df` into the baselines."""
+        if df.empty:
+            return self
+        ids = self._device_ids(df)
+        packets = df['Packets'].to_numpy(dtype=float)
+        size = int(ids.max()) + 1
+        self._grow(size)
+
+        counts = np.bincount(ids, minlength=size)
+        if self.decay < 1.0:
+            # Weight each reading by decay ** (number of later readings for the same device)
+            later = pd.Series(ids).groupby(ids, sort=False).cumcount(ascending=False).to_numpy()
+            weights = self.decay ** later
+        else:
+            weights = np.ones(len(packets))
+
+        touched = counts > 0
+        b_weight = np.bincount(ids, weights=weights, minlength=size)[touched]
+        b_mean = np.zeros(size)
+        b_mean[touched] = np.bincount(ids, weights=weights * packets, minlength=size)[touched] / b_weight
+        # Second pass over the batch for the squared deviations (numerically stable)
+        dev = packets - b_mean[ids]
+        b_m2 = np.bincount(ids, weights=weights * dev ** 2, minlength=size)[touched]
+        b_mean = b_mean[touched]
+
+        shrink = self.decay ** counts[touched] if self.decay < 1.0 else 1.0
+        o_weight = self._weight[:size][touched] * shrink
+        o_mean = self._mean[:size][touched]
+        o_m2 = self._m2[:size][touched] * shrink
+
+        # Combine old and batch statistics (Chan et al. parallel variance update)
+        weight = o_weight + b_weight
+        delta = b_mean - o_mean
+        idx = np.flatnonzero(touched)
+        self._weight[idx] = weight
+        self._mean[idx] = o_mean + delta * b_weight / weight
+        self._m2[idx] = o_m2 + b_m2 + delta ** 2 * o_weight * b_weight / weight
+        return self
+
+    def _std(self):
+        weight = self._weight
+        var = np.divide(self._m2, weight - 1, out=np.zeros_like(self._m2), where=weight > 1)
+        return np.sqrt(var)
+
+    def baseline(self):
+        """Return a frame with Device, DeviceID, BaselineMean and BaselineStd columns."""
+        ids = np.flatnonzero(self._weight > 0)
+        return pd.DataFrame({
+            'Device': self.registry.names_for(ids),
+            'DeviceID': ids.astype(np.int32),
+            'BaselineMean': self._mean[ids],
+            'BaselineStd': self._std()[ids],
+        })
+
+    def lookup(self, device_ids):
+        """Return (mean, std) arrays aligned with a sequence of device IDs.
+
+        Devices with no readings yet get a NaN mean and a zero std.
+        """
+        ids = np.asarray(device_ids, dtype=np.int64)
+        known = (ids < len(self._weight)) & (ids >= 0)
+        known[known] = self._weight[ids[known]] > 0
+        mean = np.full(len(ids), np.nan)
+        std = np.zeros(len(ids))
+        mean[known] = self._mean[ids[known]]
+        std[known] = self._std()[ids[known]]
+        return mean, std
+
+    def state(self):
+        """Picklable statistics, restored with `from_state`."""
+        return {'decay': self.decay, 'weight': self._weight, 'mean': self._mean, 'm2': self._m2}
+
+    @classmethod
+    def from_state(cls, state, registry=None):
+        store = cls(decay=state['decay'], registry=registry)
+        store._weight, store._mean, store._m2 = state['weight'], state['mean'], state['m2']
+        return store
+
+    def save(self, path):
+        with open(path, 'wb') as fh:
+            pickle.dump(self.state(), fh)
+
+    @classmethod
+    def load(cls, path, registry=None):
+        with open(path, 'rb') as fh:
+            return cls.from_state(pickle.load(fh), registry=registry)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Benchmark the detection pipeline stage by stage.
+
+Sweeps row counts, device counts and SHAP on/off over traffic from
+simulate_traffic.generate_traffic and times each stage of detect_anomalies:
+baseline, fit, predict, explanation (rule engine) and SHAP. Every run is
+written as one JSON line so results can be stored and compared:
+
+    python benchmarks/bench_detection.py --output bench.jsonl
+    python benchmarks/bench_detection.py --rows 1000 10000 --compare bench.jsonl
+
+With --compare the script exits non-zero if any stage got slower than the
+stored run by more than --tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Keep benchmark device names out of the app's device registry
+os.environ.setdefault("DEVICE_REGISTRY_PATH", os.path.join(tempfile.mkdtemp(), "device_registry.json"))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import anomaly_detector as ad  # noqa: E402
+from simulate_traffic import generate_traffic  # noqa: E402
+
+DEFAULT_ROWS = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+DEFAULT_DEVICES = [5, 50]
+# Stages faster than this are too noisy to flag as regressions
+MIN_COMPARE_SECONDS = 0.005
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run_detection(rows, devices, shap_enabled, backend="isolation_forest", seed=42):
+    """Run detect_anomalies' stages once and return a result record."""
+    names = [f"Device_{i}" for i in range(devices)]
+    traffic = generate_traffic(names, n=rows, n_anomalies=max(1, rows // 100), seed=seed,
+                               end=pd.Timestamp("2025-12-29"), freq="s")
+    timings = {}
+
+    df, timings["baseline"] = _timed(lambda: ad._add_baseline(ad._prepare_frame(traffic)))
+    X = df[ad.FEATURES]
+    detector, timings["fit"] = _timed(ad.make_detector(backend).fit, X)
+    (labels, scores), timings["predict"] = _timed(detector.score, X)
+    df["Anomaly"] = labels
+    df["AnomalyScore"] = scores
+    df, timings["explanation"] = _timed(ad._annotate, df)
+    timings["shap"] = None
+    if shap_enabled:
+        _, timings["shap"] = _timed(ad.explain_anomalies, df, detector)
+
+    total = sum(t for t in timings.values() if t is not None)
+    return {
+        "benchmark": "detect_anomalies",
+        "backend": backend,
+        "rows": rows,
+        "devices": devices,
+        "shap": shap_enabled,
+        "stages": timings,
+        "total_s": total,
+        "rows_per_s": rows / total if total else None,
+        "bytes_per_row": ad.memory_per_row(df),
+    }
+
+
+def run_homes(homes, rows_per_home, devices=5):
+    """Time detect_anomalies_batch over `homes` households with a shared model."""
+    names = [f"Device_{i}" for i in range(devices)]
+    frames = {
+        f"Home_{h}": generate_traffic(names, n=rows_per_home, n_anomalies=max(1, rows_per_home // 100),
+                                      seed=h, end=pd.Timestamp("2025-12-29"))
+        for h in range(homes)
+    }
+    detector = ad.AnomalyDetector().fit(frames["Home_0"])
+    _, elapsed = _timed(ad.detect_anomalies_batch, frames, detector=detector)
+    return {
+        "benchmark": "detect_anomalies_batch",
+        "backend": "isolation_forest",
+        "homes": homes,
+        "rows": homes * rows_per_home,
+        "devices": devices,
+        "shap": False,
+        "stages": {"batch": elapsed},
+        "total_s": elapsed,
+        "homes_per_s": homes / elapsed,
+    }
+
+
+def environment():
+    try:
+        import sklearn
+        sklearn_version = sklearn.__version__
+    except ImportError:  # the statistical backend runs without it
+        sklearn_version = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sklearn": sklearn_version,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def best_of(repeat, fn, *args):
+    """Run `fn` `repeat` times and keep the fastest time seen for each stage."""
+    best = None
+    for _ in range(repeat):
+        record = fn(*args)
+        if best is None:
+            best = record
+            continue
+        for stage, t in record["stages"].items():
+            if t is not None and t < best["stages"][stage]:
+                best["stages"][stage] = t
+    best["total_s"] = sum(t for t in best["stages"].values() if t is not None)
+    if "rows_per_s" in best:
+        best["rows_per_s"] = best["rows"] / best["total_s"]
+    if "homes_per_s" in best:
+        best["homes_per_s"] = best["homes"] / best["total_s"]
+    return best
+
+
+def _key(record):
+    return (record["benchmark"], record.get("backend", "isolation_forest"), record["rows"], record["devices"],
+            record["shap"], record.get("homes"))
+
+
+def compare(records, baseline_path, tolerance):
+    """Print per-stage ratios against a stored run; return the regressions found."""
+    with open(baseline_path, encoding="utf-8") as fh:
+        baseline = {_key(r): r for r in map(json.loads, fh) if r.get("benchmark")}
+    regressions = []
+    for record in records:
+        old = baseline.get(_key(record))
+        if old is None:
+            continue
+        for stage, new_t in record["stages"].items():
+            old_t = old["stages"].get(stage)
+            if not new_t or not old_t or max(new_t, old_t) < MIN_COMPARE_SECONDS:
+                continue
+            ratio = new_t / old_t
+            flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+            print(f"{_key(record)} {stage}: {old_t:.4f}s -> {new_t:.4f}s ({ratio:.2f}x){flag}", file=sys.stderr)
+            if flag:
+                regressions.append((_key(record), stage, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--devices", type=int, nargs="+", default=DEFAULT_DEVICES)
+    parser.add_argument("--shap", choices=["on", "off", "both"], default="both")
+    parser.add_argument("--backend", nargs="+", choices=sorted(ad.BACKENDS), default=["isolation_forest"],
+                        help="detector backends to benchmark")
+    parser.add_argument("--homes", type=int, nargs="*", default=[],
+                        help="also benchmark detect_anomalies_batch for these household counts")
+    parser.add_argument("--rows-per-home", type=int, default=1440)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per configuration; the best time per stage is kept")
+    parser.add_argument("--output", default="-", help="JSON lines output file ('-' for stdout)")
+    parser.add_argument("--compare", help="JSON lines file from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown per stage before --compare fails (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    shap_modes = {"on": [True], "off": [False], "both": [False, True]}[args.shap]
+    env = environment()
+    records = []
+    for backend in args.backend:
+        for rows in args.rows:
+            for devices in args.devices:
+                for shap_enabled in shap_modes:
+                    record = best_of(args.repeat, run_detection, rows, devices, shap_enabled, backend)
+                    records.append(record)
+                    print(f"backend={backend} rows={rows} devices={devices} shap={shap_enabled} "
+                          f"total={record['total_s']:.3f}s", file=sys.stderr)
+    for homes in args.homes:
+        record = best_of(args.repeat, run_homes, homes, args.rows_per_home)
+        records.append(record)
+        print(f"homes={homes} {record['homes_per_s']:.1f} homes/s", file=sys.stderr)
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        for record in records:
+            out.write(json.dumps({**record, "env": env}) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    if args.compare:
+        return 1 if compare(records, args.compare, args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark cold-start time of the detection core.
+
+Every measurement runs in a fresh interpreter, so nothing is cached between
+runs. It times importing each core module, the eager import set the app used
+to pay before any work could start (streamlit, scikit-learn, shap), and a
+full worker.py run that scores a small traffic file with each backend:
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --output startup.jsonl
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["metrics", "alerting", "anomaly_detector", "alerts"]
+# What `import alerts, anomaly_detector` loaded before imports were made lazy
+EAGER_IMPORTS = "import pandas, streamlit, sklearn.ensemble, shap"
+BACKENDS = ["statistical", "isolation_forest"]
+
+
+def _run(cmd, env):
+    start = time.perf_counter()
+    subprocess.run(cmd, cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def best_of(repeat, cmd, env):
+    return min(_run(cmd, env) for _ in range(repeat))
+
+
+def write_traffic(path, rows, devices):
+    sys.path.insert(0, ROOT)
+    import pandas as pd
+    from simulate_traffic import generate_traffic
+
+    names = [f"Device_{i}" for i in range(devices)]
+    generate_traffic(names, n=rows, n_anomalies=max(1, rows // 50), end=pd.Timestamp("2025-12-29")).to_csv(
+        path, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=120, help="rows in the batch the worker scores")
+    parser.add_argument("--devices", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement; the fastest is kept")
+    parser.add_argument("--output", default="-", help="JSON lines output file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ, DEVICE_REGISTRY_PATH=os.path.join(tmp, "device_registry.json"))
+    traffic = os.path.join(tmp, "traffic.csv")
+    write_traffic(traffic, args.rows, args.devices)
+
+    records = []
+
+    def record(name, cmd):
+        seconds = best_of(args.repeat, cmd, env)
+        records.append({"benchmark": "startup", "name": name, "seconds": seconds})
+        print(f"{name}: {seconds:.3f}s", file=sys.stderr)
+        return seconds
+
+    record("python", [sys.executable, "-c", "pass"])
+    eager = record("eager imports", [sys.executable, "-c", EAGER_IMPORTS])
+    for module in MODULES:
+        record(f"import {module}", [sys.executable, "-c", f"import {module}"])
+    for backend in BACKENDS:
+        seconds = record(f"worker {backend}", [sys.executable, "worker.py", traffic, "--backend", backend,
+                                               "--output", os.devnull])
+        print(f"  {seconds / eager:.0%} of the eager import time", file=sys.stderr)
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        for rec in records:
+            out.write(json.dumps({**rec, "rows": args.rows, "devices": args.devices}) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+# Where the default registry is persisted; override with DEVICE_REGISTRY_PATH
+DEFAULT_PATH = "device_registry.json"
+
+
+class DeviceRegistry:
+    """Permanent, compact integer IDs for device names.
+
+    A device keeps the ID it was first registered with for the lifetime of the
+    registry file; new devices are only ever appended. `dtype` is a shared
+    pd.CategoricalDtype whose category codes are exactly those IDs, so traffic
+    frames, baselines and models can all key on small ints.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._names = []
+        self._index = {}
+        self._dtype = None
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as fh:
+                for name in json.load(fh).get("devices", []):
+                    self._index[name] = len(self._names)
+                    self._names.append(name)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    @property
+    def names(self):
+        return list(self._names)
+
+    @property
+    def dtype(self):
+        """Categorical dtype over all registered devices, in ID order."""
+        dtype = self._dtype
+        if dtype is None or len(dtype.categories) != len(self._names):
+            dtype = self._dtype = pd.CategoricalDtype(categories=list(self._names))
+        return dtype
+
+    def register(self, devices):
+        """Register any unseen names in `devices` and persist the registry."""
+        new = [name for name in pd.unique(np.asarray(devices, dtype=object)) if name not in self._index]
+        if not new:
+            return
+        with self._lock:
+            for name in new:
+                if name not in self._index:
+                    self._index[name] = len(self._names)
+                    self._names.append(name)
+            self._save()
+
+    def ids(self, devices):
+        """Return the int32 IDs for a sequence of device names, registering new ones."""
+        return self.categorical(devices).codes.astype(np.int32)
+
+    def categorical(self, devices):
+        """Return `devices` as a pd.Categorical using the shared registry dtype."""
+        if isinstance(getattr(devices, "dtype", None), pd.CategoricalDtype):
+            self.register(devices.cat.categories if isinstance(devices, pd.Series) else devices.categories)
+        else:
+            self.register(devices)
+        return pd.Categorical(devices, dtype=self.dtype)
+
+    def names_for(self, ids):
+        """Return a pd.Categorical of device names for an array of IDs."""
+        return pd.Categorical.from_codes(np.asarray(ids), dtype=self.dtype)
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump({"devices": self._names}, fh)
+        os.replace(tmp, self.path)
+
+
+_registry = None
+
+
+def get_registry():
+    """Return the process-wide registry, loading it from disk on first use."""
+    global _registry
+    if _registry is None:
+        _registry = DeviceRegistry(os.getenv("DEVICE_REGISTRY_PATH", DEFAULT_PATH))
+    return _registry
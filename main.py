@@ -2,19 +2,48 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+import os
 
 import alerts
-from anomaly_detector import detect_anomalies
+from alert_gate import AlertGate
+import metrics
+from simulate_traffic import generate_traffic
+from anomaly_detector import (AnomalyDetector, StreamingDetector, compact_traffic, detect_anomalies,
+                              explain_anomalies_async, make_detector)
+from device_registry import get_registry
+from model_registry import ModelRegistry, SharedDetector
+from traffic_buffer import TrafficBuffer
+
+# The dashboard records pipeline metrics unless METRICS_ENABLED turns them off
+if metrics.env_enabled(default=True):
+    metrics.enable()
+if os.getenv('METRICS_PORT'):
+    metrics.start_http_server(int(os.environ['METRICS_PORT']))
+
+# Most recent monitored rows used as detection context (model fit and fleet percentile)
+MONITOR_WINDOW = 5000
+# Most recent monitored rows kept in the session's traffic history
+MONITOR_RETENTION = 100_000
+# Demo detection results kept in memory (least recently used are evicted)
+DEMO_CACHE_ENTRIES = 16
 
 # Initialize session state for real-time monitoring
 if 'traffic_data' not in st.session_state:
-    st.session_state.traffic_data = pd.DataFrame()
-if 'last_alert_ids' not in st.session_state:
-    st.session_state.last_alert_ids = set()
+    st.session_state.traffic_data = TrafficBuffer(max_rows=MONITOR_RETENTION)
+if 'alert_gate' not in st.session_state:
+    # Suppresses duplicate alerts across reruns and rate-limits each device
+    st.session_state.alert_gate = AlertGate()
+if 'demo_gate' not in st.session_state:
+    # The demo frame is dispatched on every rerun; its own gate keeps it from
+    # using up the per-device rate limit of live monitoring
+    st.session_state.demo_gate = AlertGate()
 if 'monitoring_active' not in st.session_state:
     st.session_state.monitoring_active = False
 if 'custom_devices' not in st.session_state:
     st.session_state.custom_devices = []
+if 'shap_jobs' not in st.session_state:
+    # (future, {result row position: alert record}) pairs awaiting SHAP explanations
+    st.session_state.shap_jobs = []
 
 # Default devices
 DEFAULT_DEVICES = ["Camera", "Smart Lock", "Thermostat", "Light", "Speaker"]
@@ -25,6 +54,61 @@ def get_active_devices():
         return st.session_state.custom_devices
     return DEFAULT_DEVICES
 
+
+@st.cache_resource
+def shared_models():
+    """Trained detectors shared by every session this server process runs."""
+    return ModelRegistry()
+
+
+def session_detector():
+    """Handle on the shared model for the configured backend.
+
+    Every session uses one model per backend: it is fitted by whichever
+    session first needs it (on that session's first monitored batch) and
+    reused by all the others. DeviceIDs are permanent registry IDs, so other
+    device lists score with the same model; backends that need training per
+    device (sharded) fit the new shards once, through ensure_fitted.
+    """
+    backend = os.getenv('DETECTOR_BACKEND', 'isolation_forest')
+    return SharedDetector(shared_models(), backend, lambda: make_detector(backend))
+
+
+if 'detector' not in st.session_state:
+    st.session_state.detector = session_detector()
+if 'stream' not in st.session_state:
+    # Scores each monitored batch against the history seen so far
+    st.session_state.stream = StreamingDetector(window=MONITOR_WINDOW, detector=st.session_state.detector)
+
+
+def queue_shap(results, sent, detector=None, future=None):
+    """Explain `results` in the background and fill the alert records in `sent` later.
+
+    `detector` defaults to the session's monitoring detector; pass `future` to
+    reuse an explain_anomalies_async run already started for `results`.
+    """
+    if not sent:
+        return
+    if future is None:
+        detector = detector if detector is not None else st.session_state.detector
+        future = explain_anomalies_async(results, detector)
+    st.session_state.shap_jobs.append((future, sent))
+
+
+def apply_finished_shap():
+    """Copy finished SHAP explanations onto the alerts they belong to."""
+    pending = []
+    for future, sent in st.session_state.shap_jobs:
+        if not future.done():
+            pending.append((future, sent))
+            continue
+        shap_text = future.result()
+        # The explanations are aligned with the results, so row positions map straight across
+        for pos, record in sent.items():
+            alerts.update_alert(record, SHAP_Explanation=shap_text.iloc[pos])
+    st.session_state.shap_jobs = pending
+
+
 # Page Config
 st.set_page_config(
     page_title="Smart Home Intrusion Detector",
@@ -54,6 +138,8 @@ with st.sidebar.expander("🔧 Device Configuration", expanded=False):
             if new_device.strip():
                 if new_device not in st.session_state.custom_devices:
                     st.session_state.custom_devices.append(new_device)
+                    # Give the device its permanent ID up front
+                    get_registry().register([new_device])
                     st.success(f"✅ Added: {new_device}")
                     st.rerun()
                 else:
@@ -111,10 +197,12 @@ with st.sidebar.expander("✉️ Email Settings (optional)", expanded=False):
             'SMTP_PASSWORD': smtp_password,
             'ALERT_TO': alert_to
         }
+        alerts.invalidate_smtp_config()
         st.sidebar.success("SMTP settings saved to session.")
     if clear:
         if 'smtp_config' in st.session_state:
             del st.session_state['smtp_config']
+        alerts.invalidate_smtp_config()
         st.sidebar.info("SMTP settings cleared from session.")
 
 if 'smtp_config' in st.session_state:
@@ -133,25 +221,49 @@ if st.sidebar.button('Test SMTP connection'):
 st.subheader("📡 Simulated Network Traffic")
 
 def generate_data():
-    np.random.seed(42)
-    devices = get_active_devices()
+    return compact_traffic(generate_traffic(get_active_devices(), n=120, n_anomalies=10, seed=42))
 
-    n = 120
-    packets = np.random.normal(300, 60, n).astype(int)
-    devices_col = np.random.choice(devices, n)
 
-    # Timestamps: one per minute ending now
-    timestamps = pd.date_range(end=pd.Timestamp.now(), periods=n, freq='min')
+def demo_data():
+    """Demo traffic, generated once per device list so reruns see the same frame."""
+    devices = tuple(get_active_devices())
+    cached = st.session_state.get('demo_data')
+    if cached is None or cached[0] != devices:
+        cached = st.session_state.demo_data = (devices, generate_data())
+    return cached[1]
 
-    # Inject anomalies
-    for i in np.random.choice(range(n), 10, replace=False):
-        packets[i] = np.random.randint(800, 1200)
 
-    return pd.DataFrame({
-        "Device": devices_col,
-        "Packets": packets,
-        "Timestamp": timestamps
-    })
+# Keyed on the frame's contents and the detector parameters, so reruns caused by
+# unrelated widgets (typing a device name, saving SMTP settings) skip the fit.
+# SHAP is left to explain_anomalies_async, like the monitoring path
+@st.cache_data(max_entries=DEMO_CACHE_ENTRIES, show_spinner=False)
+def demo_detection(df, contamination=0.05, random_state=42):
+    """Return (results, fitted detector) for the demo frame."""
+    detector = AnomalyDetector(contamination=contamination, random_state=random_state)
+    return detect_anomalies(df, detector=detector, explain=False), detector
+
+
+def demo_shap(results, detector):
+    """Return the explain_anomalies_async future for the demo results.
+
+    Started once per demo frame and kept in session state, so reruns pick up
+    the finished explanations instead of starting another run.
+    """
+    devices = st.session_state.demo_data[0]
+    job = st.session_state.get('demo_shap')
+    if job is None or job[0] != devices:
+        job = st.session_state.demo_shap = (devices, explain_anomalies_async(results, detector))
+    return job[1]
+
+
+def reset_monitoring():
+    """Start monitoring from fresh baseline traffic, which later batches are scored against."""
+    history = generate_data()
+    st.session_state.traffic_data = TrafficBuffer(max_rows=MONITOR_RETENTION)
+    st.session_state.traffic_data.append(history)
+    st.session_state.detector = session_detector()
+    st.session_state.stream = StreamingDetector(window=MONITOR_WINDOW, detector=st.session_state.detector)
+    st.session_state.stream.seed(history)
 
 
 def add_incoming_traffic(num_packets=10):
@@ -161,7 +273,7 @@ def add_incoming_traffic(num_packets=10):
     # Generate new traffic
     new_packets = np.random.normal(300, 60, num_packets).astype(int)
     new_devices = np.random.choice(devices, num_packets)
-    new_timestamps = pd.date_range(start=st.session_state.traffic_data['Timestamp'].max() + timedelta(minutes=1), periods=num_packets, freq='min')
+    new_timestamps = pd.date_range(start=st.session_state.traffic_data.last_timestamp() + timedelta(minutes=1), periods=num_packets, freq='min')
     
     # Randomly inject attack traffic
     attack_indices = np.random.choice(range(num_packets), max(1, num_packets // 5), replace=False)
@@ -174,31 +286,21 @@ def add_incoming_traffic(num_packets=10):
         "Timestamp": new_timestamps
     })
     
-    # Append to existing traffic
-    st.session_state.traffic_data = pd.concat([st.session_state.traffic_data, new_data], ignore_index=True)
+    # Append to the traffic history (amortized O(new rows))
+    st.session_state.traffic_data.append(new_data)
     
-    # Detect anomalies on full dataset
-    results = detect_anomalies(st.session_state.traffic_data)
+    # Score only the new rows, against the monitored history (model is fitted once
+    # per session); SHAP runs in the background so alerts are not held up by it
+    results = st.session_state.stream.push(new_data)
     
     # Send alerts for newly detected HIGH/MEDIUM anomalies
-    for idx, row in results.iterrows():
-        if row["Risk"] != "LOW":
-            alert_id = hash((row["Device"], row["Timestamp"], row["Risk"]))
-            
-            if alert_id not in st.session_state.last_alert_ids:
-                alerts.send_alert(
-                    device=row["Device"],
-                    packets=row["Packets"],
-                    risk=row["Risk"],
-                    risk_score=row.get('RiskScore', None),
-                    explanation=row.get('Explanation', ''),
-                    shap_explanation=row.get('SHAP_Explanation', '')
-                )
-                st.session_state.last_alert_ids.add(alert_id)
+    with metrics.timer('alert_loop'):
+        sent = alerts.dispatch(results, st.session_state.alert_gate)
+    queue_shap(results, sent)
     
     return results
 
-df = generate_data()
+df = demo_data()
 st.dataframe(df, use_container_width=True)
 
 st.divider()
@@ -209,50 +311,43 @@ st.subheader("📡 Real-Time Network Traffic Monitoring")
 col1, col2, col3 = st.columns(3)
 with col1:
     if st.button("🔄 Initialize System"):
-        st.session_state.traffic_data = generate_data()
-        st.session_state.last_alert_ids = set()
+        reset_monitoring()
+        st.session_state.alert_gate = AlertGate()
         st.success("System initialized with baseline traffic data.")
 with col2:
     if st.button("📥 Simulate Incoming Traffic"):
         if len(st.session_state.traffic_data) == 0:
-            st.session_state.traffic_data = generate_data()
+            reset_monitoring()
         results = add_incoming_traffic(num_packets=15)
         st.success("✅ New traffic packet processed. Alerts sent for anomalies.")
 with col3:
     if st.button("🚨 Simulate Attack"):
         if len(st.session_state.traffic_data) == 0:
-            st.session_state.traffic_data = generate_data()
+            reset_monitoring()
         devices = get_active_devices()
         attack_packets = np.random.randint(1200, 2000, 20)
         attack_devices = np.random.choice(devices, 20)
-        attack_timestamps = pd.date_range(start=st.session_state.traffic_data['Timestamp'].max() + timedelta(minutes=1), periods=20, freq='min')
+        attack_timestamps = pd.date_range(start=st.session_state.traffic_data.last_timestamp() + timedelta(minutes=1), periods=20, freq='min')
         
         attack_data = pd.DataFrame({
             "Device": attack_devices,
             "Packets": attack_packets,
             "Timestamp": attack_timestamps
         })
-        st.session_state.traffic_data = pd.concat([st.session_state.traffic_data, attack_data], ignore_index=True)
+        st.session_state.traffic_data.append(attack_data)
         
-        results = detect_anomalies(st.session_state.traffic_data)
-        for idx, row in results.iterrows():
-            if row["Risk"] != "LOW":
-                alert_id = hash((row["Device"], row["Timestamp"], row["Risk"]))
-                if alert_id not in st.session_state.last_alert_ids:
-                    alerts.send_alert(
-                        device=row["Device"],
-                        packets=row["Packets"],
-                        risk=row["Risk"],
-                        risk_score=row.get('RiskScore', None),
-                        explanation=row.get('Explanation', ''),
-                        shap_explanation=row.get('SHAP_Explanation', '')
-                    )
-                    st.session_state.last_alert_ids.add(alert_id)
+        results = st.session_state.stream.push(attack_data)
+        with metrics.timer('alert_loop'):
+            sent = alerts.dispatch(results, st.session_state.alert_gate)
+        queue_shap(results, sent)
         st.warning("🚨 Attack simulated — HIGH packet traffic injected and alerts triggered!")
 
 if len(st.session_state.traffic_data) > 0:
-    st.write(f"**Total packets monitored:** {len(st.session_state.traffic_data)}")
-    st.dataframe(st.session_state.traffic_data.tail(20), use_container_width=True)
+    traffic = st.session_state.traffic_data
+    st.write(f"**Total packets monitored:** {traffic.total_rows}")
+    st.caption(f"Memory per monitored row: {traffic.nbytes / len(traffic):.1f} bytes "
+               f"(last {len(traffic)} rows kept)")
+    st.dataframe(traffic.tail(20), use_container_width=True)
 else:
     st.info("Click 'Initialize System' to start monitoring.")
 
@@ -261,7 +356,10 @@ st.divider()
 # Detection (Demo Mode)
 st.subheader("🧠 Anomaly Detection (Demo with Initial Data)")
 
-results = detect_anomalies(df)
+results, demo_detector = demo_detection(df)
+shap_future = demo_shap(results, demo_detector)
+if shap_future.done():
+    results['SHAP_Explanation'] = shap_future.result()
 display_cols = ['Device','Packets','Timestamp','Risk','RiskScore','Explanation','CyberContext']
 if 'SHAP_Explanation' in results.columns:
     display_cols.append('SHAP_Explanation')
@@ -274,24 +372,29 @@ st.divider()
 # Alerts
 st.subheader("🚨 Alerts")
 
-for _, row in results.iterrows():
-    if row["Risk"] != "LOW":
-        alert_id = hash((row["Device"], row["Timestamp"], row["Risk"]))
-        if alert_id not in st.session_state.last_alert_ids:
-            alerts.send_alert(
-                device=row["Device"],
-                packets=row["Packets"],
-                risk=row["Risk"],
-                risk_score=row.get('RiskScore', None),
-                explanation=row.get('Explanation', ''),
-                shap_explanation=row.get('SHAP_Explanation', '')
-            )
-            st.session_state.last_alert_ids.add(alert_id)
+with metrics.timer('alert_loop'):
+    sent = alerts.dispatch(results, st.session_state.demo_gate)
+queue_shap(results, sent, future=shap_future)
 
 st.divider()
 
+apply_finished_shap()
 alerts.show_alert_dashboard()
 
 st.divider()
 
+# Pipeline metrics (per-stage latency and counters); METRICS_FILE / METRICS_PORT export them
+with st.expander("📈 Pipeline Metrics", expanded=False):
+    snap = metrics.snapshot()
+    if snap['stages']:
+        st.dataframe(pd.DataFrame(snap['stages']).T.round(2), use_container_width=True)
+    else:
+        st.caption("No stage timings recorded yet.")
+    if snap['counters']:
+        st.json(snap['counters'])
+if os.getenv('METRICS_FILE'):
+    metrics.write_metrics(os.environ['METRICS_FILE'])
+
+st.divider()
+
 st.success("✅ Smart Home Intrusion Detector — Real-Time Monitoring Active")
@@ -0,0 +1,228 @@
+"""In-process metrics for detection and alerting.
+
+Records a latency histogram per pipeline stage (baseline, fit, predict,
+explanation, shap, alert_loop, smtp, ...) and simple counters (rows scored,
+alerts raised, emails sent/failed). Metrics are exposed in the Prometheus text
+format through `render_prometheus`, `write_metrics` (a file) or
+`start_http_server` (a local /metrics endpoint), and as plain dicts through
+`snapshot` for the dashboard panel.
+
+Collection is off unless `enable()` is called or METRICS_ENABLED is on (see
+`env_enabled`);
+while disabled `timer` hands back a shared no-op context manager and `inc`
+returns immediately, so instrumented code pays next to nothing.
+"""
+
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+__all__ = [
+    "env_enabled", "enable", "disable", "is_enabled", "timer", "observe", "inc", "reset",
+    "snapshot", "render_prometheus", "write_metrics", "start_http_server",
+]
+
+PREFIX = "shid"
+# Latency histogram bucket upper bounds in seconds (+Inf is implicit)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def env_enabled(default=False):
+    """Whether the METRICS_ENABLED environment variable turns metrics on.
+
+    1/true/yes/on (any case) mean on and any other value means off; `default`
+    applies when the variable is unset or empty.
+    """
+    value = os.getenv("METRICS_ENABLED", "").strip().lower()
+    if not value:
+        return default
+    return value in ("1", "true", "yes", "on")
+
+
+_enabled = env_enabled()
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_NULL = nullcontext()
+_server = None
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, seconds):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += seconds
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Upper bucket bound containing the q-quantile (an over-estimate)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+
+class _Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def timer(stage):
+    """Context manager recording the duration of the block under `stage`."""
+    if not _enabled:
+        return _NULL
+    return _Timer(stage)
+
+
+def observe(stage, seconds):
+    """Record one `stage` duration in seconds."""
+    if not _enabled:
+        return
+    with _lock:
+        hist = _histograms.get(stage)
+        if hist is None:
+            hist = _histograms[stage] = _Histogram()
+        hist.add(seconds)
+
+
+def inc(name, value=1, **labels):
+    """Increase counter `name` (optionally labelled, e.g. risk='HIGH') by `value`."""
+    if not _enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def snapshot():
+    """Return {'stages': {stage: stats}, 'counters': {name: value}} for display."""
+    with _lock:
+        stages = {
+            stage: {
+                "count": h.count,
+                "mean_ms": 1000 * h.total / h.count if h.count else 0.0,
+                "p50_ms": 1000 * h.quantile(0.5),
+                "p95_ms": 1000 * h.quantile(0.95),
+                "max_ms": 1000 * h.max,
+            }
+            for stage, h in _histograms.items()
+        }
+        counters = {}
+        for (name, labels), value in _counters.items():
+            label_text = ",".join(f"{k}={v}" for k, v in labels)
+            counters[f"{name}{{{label_text}}}" if label_text else name] = value
+    return {"stages": stages, "counters": counters}
+
+
+def _label_str(labels):
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+
+def render_prometheus():
+    """Render all metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        if _histograms:
+            name = f"{PREFIX}_stage_latency_seconds"
+            lines.append(f"# HELP {name} Latency of detection and alerting stages.")
+            lines.append(f"# TYPE {name} histogram")
+            for stage, h in sorted(_histograms.items()):
+                cumulative = 0
+                for bound, n in zip(BUCKETS + (float("inf"),), h.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {h.total}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {h.count}')
+        for counter in sorted({name for name, _ in _counters}):
+            full = f"{PREFIX}_{counter}_total"
+            lines.append(f"# TYPE {full} counter")
+            for (name, labels), value in sorted(_counters.items()):
+                if name == counter:
+                    suffix = f"{{{_label_str(labels)}}}" if labels else ""
+                    lines.append(f"{full}{suffix} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path):
+    """Write the Prometheus text to `path` (atomically, for node-exporter style scraping)."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(render_prometheus())
+    os.replace(tmp, path)
+
+
+def start_http_server(port=9108, host="127.0.0.1"):
+    """Serve /metrics on a background thread (once per process); returns the server."""
+    # Imported here so importing metrics stays cheap for headless workers
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
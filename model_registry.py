@@ -0,0 +1,187 @@
+import threading
+from contextlib import contextmanager
+
+
+class RWLock:
+    """Readers-writer lock: any number of readers, or one writer.
+
+    Writers take precedence: once a writer is waiting, new readers wait too,
+    so a model swap is not starved by a steady stream of scoring calls.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class ModelRegistry:
+    """Process-wide store of trained detectors (or baselines), shared by key.
+
+    Lookups and scoring hold the read lock, so any number of sessions use a
+    model at once; `publish` swaps in a replacement under the write lock,
+    waiting for scoring calls in progress to finish. `rebuild` trains
+    outside both locks while holding a per-key build lock, so when many
+    sessions need the same model it is trained once and the others reuse it.
+    """
+
+    def __init__(self):
+        self._lock = RWLock()
+        self._models = {}
+        self._build_locks = {}
+        self._build_locks_guard = threading.Lock()
+
+    def __len__(self):
+        with self._lock.read():
+            return len(self._models)
+
+    def __contains__(self, key):
+        with self._lock.read():
+            return key in self._models
+
+    def get(self, key):
+        with self._lock.read():
+            return self._models.get(key)
+
+    @contextmanager
+    def reading(self, key):
+        """Hold the read lock and yield the model for `key` (None if there is none)."""
+        with self._lock.read():
+            yield self._models.get(key)
+
+    @contextmanager
+    def writing(self, key):
+        """Hold the write lock and yield the model for `key`, for changes made in place."""
+        with self._lock.write():
+            yield self._models.get(key)
+
+    def publish(self, key, model):
+        """Make `model` the one used for `key` from now on."""
+        with self._lock.write():
+            self._models[key] = model
+
+    def _build_lock(self, key):
+        with self._build_locks_guard:
+            return self._build_locks.setdefault(key, threading.Lock())
+
+    def rebuild(self, key, build, needed=None):
+        """Replace the model for `key` with `build(current)` and return it.
+
+        With `needed`, the model is only rebuilt if `needed(current)` is true
+        once the build lock is held, so concurrent callers that all found the
+        model missing or stale train it only once.
+        """
+        with self._build_lock(key):
+            current = self.get(key)
+            if needed is not None and not needed(current):
+                return current
+            model = build(current)
+            self.publish(key, model)
+            return model
+
+    def get_or_build(self, key, build):
+        """Return the model for `key`, building it with `build()` if there is none yet."""
+        model = self.get(key)
+        if model is not None:
+            return model
+        return self.rebuild(key, lambda current: build(), needed=lambda current: current is None)
+
+
+class SharedDetector:
+    """Detector interface backed by a model in a ModelRegistry.
+
+    Many sessions can hold a SharedDetector for the same key (e.g. the
+    backend name): the first one that needs a fitted model trains it via
+    `factory()` and everyone else scores with that model. New models are
+    trained off-lock and swapped in; fits that extend the current model
+    (new shards) and scoring by detectors that update themselves
+    (StatisticalDetector with adapt=True) hold the write lock.
+    """
+
+    def __init__(self, registry, key, factory):
+        self.registry = registry
+        self.key = key
+        self.factory = factory
+
+    @property
+    def model(self):
+        return self.registry.get(self.key)
+
+    @property
+    def is_fitted(self):
+        model = self.model
+        return model is not None and model.is_fitted
+
+    def needs_fit(self, batch):
+        with self.registry.reading(self.key) as model:
+            return model is None or model.needs_fit(batch)
+
+    def ensure_fitted(self, historical):
+        """Fit the shared model on `historical` unless it already covers it."""
+        def build(current):
+            if current is None:
+                return self.factory().ensure_fitted(historical)
+            # Partial fits (e.g. ShardedDetector training new shards) update the model in place
+            with self.registry.writing(self.key) as model:
+                return model.ensure_fitted(historical)
+
+        def needed(current):
+            return current is None or current.needs_fit(historical)
+
+        self.registry.rebuild(self.key, build, needed=needed)
+        return self
+
+    def fit(self, historical):
+        """Train a new model on `historical` and swap it in for every session."""
+        self.registry.rebuild(self.key, lambda current: self.factory().fit(historical))
+        return self
+
+    def score(self, batch, update=True):
+        model = self.model
+        if model is None:
+            raise RuntimeError("Shared detector must be fitted before scoring")
+        lock = self.registry.writing if update and getattr(model, 'adapt', False) else self.registry.reading
+        with lock(self.key) as model:
+            return model.score(batch, update=update)
+
+    @property
+    def supports_shap(self):
+        return getattr(self.model, 'supports_shap', False)
+
+    def shap_values(self, X):
+        with self.registry.reading(self.key) as model:
+            return model.shap_values(X)
+
+    def save(self, path):
+        with self.registry.reading(self.key) as model:
+            model.save(path)
@@ -17,3 +17,28 @@ def simulate_traffic(devices, n=200):
         data.append([device, packets, timestamp])
     df = pd.DataFrame(data, columns=['Device', 'Packets', 'Timestamp'])
     return df
+
+
+def generate_traffic(devices, n=120, n_anomalies=10, seed=42, end=None, freq='min'):
+    """Vectorized traffic generator: one reading per `freq` ending at `end`.
+
+    Packets are drawn from N(300, 60) with `n_anomalies` rows replaced by
+    spikes of 800-1200 packets. Used by the dashboard and the benchmarks, so
+    it stays fast for millions of rows.
+    """
+    rng = np.random.RandomState(seed)
+    packets = rng.normal(300, 60, n).astype(int)
+    devices_col = rng.choice(devices, n)
+
+    # Timestamps: one per `freq` ending at `end` (default now)
+    timestamps = pd.date_range(end=end if end is not None else pd.Timestamp.now(), periods=n, freq=freq)
+
+    # Inject anomalies
+    spikes = rng.choice(n, min(n_anomalies, n), replace=False)
+    packets[spikes] = rng.randint(800, 1200, len(spikes))
+
+    return pd.DataFrame({
+        "Device": devices_col,
+        "Packets": packets,
+        "Timestamp": timestamps
+    })
@@ -0,0 +1,31 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Keep the device registry and alert store written during tests out of the working tree
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('DEVICE_REGISTRY_PATH', os.path.join(_tmp, 'device_registry.json'))
+os.environ.setdefault('ALERT_DB_PATH', os.path.join(_tmp, 'alerts.db'))
+
+
+@pytest.fixture
+def make_traffic():
+    """Factory for Device/Packets/Timestamp traffic, one row a minute.
+
+    Packets are normal around 300, with `spikes` rows replaced by 800-1200
+    packet bursts so there are anomalies to find.
+    """
+    def make(n=200, seed=0, spikes=10):
+        rng = np.random.RandomState(seed)
+        packets = rng.normal(300, 60, n).astype(int)
+        if spikes:
+            packets[rng.choice(n, spikes, replace=False)] = rng.randint(800, 1200, spikes)
+        return pd.DataFrame({
+            'Device': rng.choice(['Camera', 'Smart Lock', 'Thermostat'], n),
+            'Packets': packets,
+            'Timestamp': pd.date_range('2025-12-29', periods=n, freq='min'),
+        })
+    return make
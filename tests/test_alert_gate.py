@@ -0,0 +1,60 @@
+import pandas as pd
+
+from alert_gate import AlertGate, alert_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_duplicates_expire_and_keys_are_bounded():
+    clock = FakeClock()
+    gate = AlertGate(ttl=60, max_keys=100, burst=1000, clock=clock)
+    ts = pd.Timestamp('2025-12-29 10:00')
+
+    assert gate.allow('Camera', ts, 'HIGH')
+    assert gate.check('Camera', ts, 'HIGH') == 'duplicate'
+    assert gate.allow('Camera', ts, 'MEDIUM')
+
+    clock.now += 61
+    assert gate.allow('Camera', ts, 'HIGH')
+
+    for minute in range(500):
+        gate.allow('Camera', ts + pd.Timedelta(minutes=minute + 1), 'HIGH')
+    assert len(gate) == 100
+    assert alert_key('Camera', ts, 'HIGH') == alert_key('Camera', str(ts), 'HIGH')
+
+
+def test_token_bucket_limits_each_device(tmp_path):
+    clock = FakeClock()
+    gate = AlertGate(rate=1 / 10, burst=3, clock=clock)
+    times = pd.date_range('2025-12-29', periods=20, freq='s')
+
+    raised = [gate.allow('Camera', ts, 'HIGH') for ts in times[:10]]
+    assert raised == [True] * 3 + [False] * 7
+    assert gate.allow('Smart Lock', times[0], 'HIGH')
+
+    clock.now += 10
+    assert gate.allow('Camera', times[10], 'HIGH')
+    assert not gate.allow('Camera', times[11], 'HIGH')
+
+    path = tmp_path / 'gate.pkl'
+    gate.save(path)
+    restored = AlertGate.load(path, rate=1 / 10, burst=3, clock=clock)
+    assert restored.check('Camera', times[0], 'HIGH') == 'duplicate'
+
+
+def test_allow_many_matches_row_by_row_checks():
+    times = pd.date_range('2025-12-29', periods=12, freq='min')
+    devices = ['Camera', 'Light', 'Camera'] * 4
+    risks = ['HIGH', 'MEDIUM'] * 6
+    single, batch = AlertGate(burst=3, clock=FakeClock()), AlertGate(burst=3, clock=FakeClock())
+
+    expected = [single.allow(d, t, r) for d, t, r in zip(devices, times, risks)]
+    assert batch.allow_many(devices, times, risks).tolist() == expected
+    assert not batch.allow_many(devices[:1], times[:1], risks[:1]).any()
+    assert batch.check(devices[0], str(times[0]), risks[0]) == 'duplicate'
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+from alert_store import AlertStore
+from alerting import make_record
+
+
+def _records(n, start='2025-12-29 00:00:00'):
+    times = pd.date_range(start, periods=n, freq='min')
+    rng = np.random.RandomState(0)
+    return [
+        make_record(f'Device_{i % 3}', 900 + i, ['MEDIUM', 'HIGH'][i % 2], np.float32(rng.uniform(40, 100)),
+                    timestamp=ts.strftime('%Y-%m-%d %H:%M:%S'))
+        for i, ts in enumerate(times)
+    ]
+
+
+def test_batched_inserts_and_queries(tmp_path):
+    path = tmp_path / 'alerts.db'
+    store = AlertStore(str(path), batch_size=50)
+    records = _records(120)
+    ids = store.add_many(records[:100])
+    for record in records[100:]:
+        store.add(record)
+    assert ids == list(range(1, 101)) and records[-1]['ID'] == 120
+    assert len(store) == 120
+
+    window = store.query(start='2025-12-29 00:10', end='2025-12-29 00:20')
+    assert len(window) == 10
+    assert window['Time'].is_monotonic_decreasing
+
+    device = store.query(device='Device_1', risk='HIGH')
+    assert set(device['Device']) == {'Device_1'} and set(device['Risk']) == {'HIGH'}
+    assert len(device) == store.count(device='Device_1', risk='HIGH')
+
+    top = store.top(5)
+    expected = sorted((float(str(r['RiskScore'])) for r in records), reverse=True)[:5]
+    assert top['RiskScore'].tolist() == expected
+
+    page = store.query(limit=20, offset=20)
+    assert page['ID'].tolist() == list(range(100, 80, -1))
+
+    store.update(records[0]['ID'], Email='sent', SHAP_Explanation='Packets:0.500')
+    store.close()
+
+    reopened = AlertStore(str(path))
+    first = reopened.query(end='2025-12-29 00:01')
+    assert first.loc[0, 'Email'] == 'sent' and first.loc[0, 'SHAP_Explanation'] == 'Packets:0.500'
+    assert reopened.add(make_record('Camera', 1000, 'HIGH')) == 121
+
+
+def test_aggregates_track_every_flush(tmp_path):
+    path = tmp_path / 'alerts.db'
+    store = AlertStore(str(path), batch_size=7)
+    records = _records(30) + _records(30)
+    store.add_many(records[:25])
+    for record in records[25:]:
+        store.add(record)
+
+    full = store.query()
+    per_minute = store.per_minute()
+    assert per_minute.sum().sum() == 60
+    assert (per_minute.sum(axis=1) == 2).all()
+    assert len(store.per_minute(last=5)) == 5
+    assert store.per_minute(last=5).index.max() == full['Time'].max()
+
+    totals = store.device_totals()
+    expected = full.groupby('Device').agg(Total=('ID', 'size'), MaxRiskScore=('RiskScore', 'max'))
+    assert totals['Total'].sort_index().tolist() == expected['Total'].tolist()
+    assert totals['MaxRiskScore'].sort_index().tolist() == expected['MaxRiskScore'].tolist()
+    assert (totals['HIGH'] + totals['MEDIUM'] == totals['Total']).all()
+    store.close()
+
+    # Aggregates are rebuilt for a store that predates them
+    import sqlite3
+    with sqlite3.connect(path) as conn:
+        conn.execute('DELETE FROM alert_minutes')
+        conn.execute('DELETE FROM alert_devices')
+    assert AlertStore(str(path)).device_totals()['Total'].sum() == 60
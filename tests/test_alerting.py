@@ -0,0 +1,182 @@
+import smtplib
+import threading
+import time
+from unittest.mock import MagicMock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import alerting
+
+
+def _record(device='Camera', risk='HIGH'):
+    return alerting.make_record(device, 900, risk, risk_score=88.0, timestamp='2025-12-29 00:00:00')
+
+
+def test_make_records_matches_make_record():
+    results = pd.DataFrame({
+        'Device': ['Camera', 'Light'],
+        'Packets': np.array([900, 1200], dtype=np.int32),
+        'Risk': ['HIGH', 'MEDIUM'],
+        'RiskScore': np.array([72.3, np.nan], dtype=np.float32),
+        'Explanation': ['spike', 'burst'],
+    }, index=[4, 9])
+
+    records = alerting.make_records(results, timestamp='2025-12-29 00:00:00')
+    assert len(records) == 2
+    assert records[0] == alerting.make_record('Camera', 900, 'HIGH', np.float32(72.3), 'spike',
+                                              timestamp='2025-12-29 00:00:00')
+    assert records[1]['RiskScore'] is None and records[1]['SHAP_Explanation'] is None
+
+
+CFG = {'SMTP_HOST': 'smtp.test', 'SMTP_PORT': 587, 'SMTP_USER': None, 'SMTP_PASSWORD': None,
+       'ALERT_TO': 'a@test.com'}
+
+
+def test_submit_returns_before_delivery():
+    release = threading.Event()
+    sent = []
+
+    def slow_send(cfg, record):
+        release.wait(5)
+        sent.append(record['Device'])
+
+    alert_queue = alerting.AlertQueue(send=slow_send)
+    record = _record()
+    assert alert_queue.submit(CFG, record)
+    assert record['Email'] in ('queued', 'sending') and not sent
+
+    release.set()
+    assert alert_queue.join(timeout=5)
+    assert record['Email'] == 'sent' and sent == ['Camera']
+    assert alert_queue.pop_events() == [record]
+
+
+def test_transient_errors_are_retried_and_auth_errors_are_not():
+    calls = []
+
+    def flaky_send(cfg, record):
+        calls.append(record['Device'])
+        if record['Device'] == 'Lock':
+            raise smtplib.SMTPAuthenticationError(535, b'bad credentials')
+        if calls.count('Camera') < 3:
+            raise ConnectionRefusedError('connection refused')
+
+    alert_queue = alerting.AlertQueue(send=flaky_send, max_retries=3, backoff=0.001)
+    camera, lock = _record('Camera'), _record('Lock')
+    alert_queue.submit(CFG, camera)
+    alert_queue.submit(CFG, lock)
+    assert alert_queue.join(timeout=5)
+
+    assert camera['Email'] == 'sent' and calls.count('Camera') == 3
+    assert lock['Email'] == 'failed' and calls.count('Lock') == 1
+    assert lock['EmailError'].startswith('SMTPAuthenticationError')
+
+
+def test_full_queue_drops_instead_of_blocking():
+    release = threading.Event()
+    alert_queue = alerting.AlertQueue(maxsize=1, send=lambda cfg, record: release.wait(5))
+    records = [_record(f'Device_{i}') for i in range(4)]
+    accepted = [alert_queue.submit(CFG, r) for r in records]
+    release.set()
+    alert_queue.join(timeout=5)
+
+    assert not all(accepted)
+    assert {r['Email'] for r in records} <= {'sent', 'dropped'}
+    assert alert_queue.counts['dropped'] == accepted.count(False)
+
+
+def test_smtp_session_is_reused_and_reconnects(monkeypatch):
+    servers = []
+
+    def fake_smtp(host, port, timeout=None):
+        server = MagicMock()
+        server.__enter__.return_value = server
+        server.noop.return_value = (250, b'OK')
+        servers.append(server)
+        return server
+
+    monkeypatch.setattr(smtplib, 'SMTP', fake_smtp)
+    alerting.close_sessions()
+    cfg = dict(CFG, SMTP_USER='user@test.com', SMTP_PASSWORD='secret')
+
+    for device in ('Camera', 'Lock', 'Plug'):
+        alerting.send_email(cfg, _record(device))
+    assert len(servers) == 1
+    assert servers[0].login.call_count == 1 and servers[0].send_message.call_count == 3
+
+    # The server dropped the idle connection: the send is retried on a new one
+    servers[0].send_message.side_effect = smtplib.SMTPServerDisconnected('gone')
+    alerting.send_email(cfg, _record('Camera'))
+    assert len(servers) == 2 and servers[1].send_message.call_count == 1
+
+    # The connection test reuses the same pooled session
+    assert alerting.check_smtp_connection(cfg)[0]
+    assert len(servers) == 2
+    alerting.close_sessions()
+
+
+def test_closing_a_session_waits_for_the_send_in_progress(monkeypatch):
+    sending, release = threading.Event(), threading.Event()
+    server = MagicMock()
+    server.__enter__.return_value = server
+    server.send_message.side_effect = lambda msg: (sending.set(), release.wait(5))
+    monkeypatch.setattr(smtplib, 'SMTP', lambda host, port, timeout=None: server)
+    session = alerting.SMTPSession(CFG)
+
+    sender = threading.Thread(target=session.send, args=(alerting.build_message(CFG, _record()),))
+    sender.start()
+    assert sending.wait(5)
+    closer = threading.Thread(target=session.close)
+    closer.start()
+    closer.join(0.2)
+    assert closer.is_alive() and not server.__exit__.called
+
+    release.set()
+    sender.join(5)
+    closer.join(5)
+    assert not closer.is_alive() and server.__exit__.called
+
+
+def test_digest_coalesces_alerts_and_high_bypasses():
+    sent = []
+    digest = alerting.AlertDigest(window=0.2, group_by={'Camera 1': 'Cameras', 'Camera 2': 'Cameras'})
+    alert_queue = alerting.AlertQueue(send=lambda cfg, record: sent.append(record), digest=digest)
+
+    medium = [_record(device, 'MEDIUM') for device in ['Camera 1', 'Camera 2'] * 10]
+    lock = _record('Smart Lock', 'MEDIUM')
+    high = _record('Camera 1', 'HIGH')
+    for record in medium + [lock, high]:
+        assert alert_queue.submit(CFG, record)
+
+    assert alert_queue.join(timeout=5)
+    assert sent == [high]
+    assert {r['Email'] for r in medium} == {'digest'}
+
+    deadline = time.monotonic() + 5
+    while len(sent) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert alert_queue.join(timeout=5)
+    digests = {d['Device']: d for d in sent[1:]}
+    assert set(digests) == {'Cameras', 'Smart Lock'}
+    assert len(digests['Cameras']['Digest']) == 20
+    assert {r['Email'] for r in medium + [lock]} == {'sent'}
+
+    msg = alerting.build_message(CFG, digests['Cameras'])
+    assert msg['Subject'] == '[MEDIUM] Intrusion digest — 20 alerts on Cameras'
+
+
+def test_resolved_config_is_validated_and_read_only():
+    env = {'SMTP_HOST': ' smtp.env ', 'SMTP_PORT': 'not-a-port', 'ALERT_TO': 'a@test.com, ,b@test.com'}
+    cfg = alerting.resolve_smtp_config(environ=env)
+    assert cfg['SMTP_HOST'] == 'smtp.env' and cfg['SMTP_PORT'] == 587
+    assert cfg['RECIPIENTS'] == ('a@test.com', 'b@test.com')
+    with pytest.raises(TypeError):
+        cfg['SMTP_HOST'] = 'other'
+
+    # Sidebar settings win over secrets, which win over the environment
+    secrets = {'SMTP_HOST': 'smtp.secrets', 'SMTP_PORT': 2525}
+    assert alerting.resolve_smtp_config(None, secrets, env)['SMTP_HOST'] == 'smtp.secrets'
+    assert alerting.resolve_smtp_config({'SMTP_HOST': 'smtp.ui'}, secrets, env)['SMTP_HOST'] == 'smtp.ui'
+    assert alerting.resolve_smtp_config(None, {}, {}) is None
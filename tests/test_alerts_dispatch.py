@@ -0,0 +1,74 @@
+import pandas as pd
+
+import alerts
+from alert_gate import AlertGate
+from alert_store import get_alert_store
+
+
+def test_dispatch_summarises_only_observed_categories(monkeypatch):
+    shown, emailed = [], []
+    monkeypatch.setattr(alerts.st, 'error', lambda text: shown.append(('error', text)))
+    monkeypatch.setattr(alerts.st, 'warning', lambda text: shown.append(('warning', text)))
+    monkeypatch.setattr(alerts, '_queue_emails', emailed.extend)
+
+    devices = pd.Categorical(['A', 'B', 'C', 'B'], categories=['A', 'B', 'C', 'D', 'E', 'F'])
+    results = pd.DataFrame({
+        'Device': devices,
+        'Packets': [300, 1200, 310, 900],
+        'Timestamp': pd.date_range('2025-12-29', periods=4, freq='min'),
+        'Risk': pd.Categorical(['LOW', 'MEDIUM', 'LOW', 'MEDIUM'], categories=['LOW', 'MEDIUM', 'HIGH']),
+        'RiskScore': [10.0, 55.0, 12.0, 48.0],
+        'Explanation': ['', 'spike', '', 'spike'],
+    })
+    before = len(get_alert_store())
+
+    sent = alerts.dispatch(results, AlertGate())
+
+    assert sorted(sent) == [1, 3]
+    assert len(get_alert_store()) == before + 2
+    assert shown == [('warning', '⚠️ 2 MEDIUM risk alert(s) on B')]
+    assert len(emailed) == 2
+
+
+def test_rate_limited_alerts_are_recorded_but_not_notified(monkeypatch):
+    shown, emailed = [], []
+    monkeypatch.setattr(alerts.st, 'error', lambda text: shown.append(text))
+    monkeypatch.setattr(alerts.st, 'caption', lambda text: shown.append(text))
+    monkeypatch.setattr(alerts, '_queue_emails', emailed.extend)
+    results = pd.DataFrame({
+        'Device': ['Camera'] * 5,
+        'Packets': [1500] * 5,
+        'Timestamp': pd.date_range('2025-12-30', periods=5, freq='min'),
+        'Risk': ['HIGH'] * 5,
+        'RiskScore': [90.0] * 5,
+    })
+    gate = AlertGate(burst=2)
+    before = len(get_alert_store())
+
+    assert len(alerts.dispatch(results, gate)) == 5
+    assert len(get_alert_store()) == before + 5
+    assert len(emailed) == 2
+    assert shown == ['🚨 2 HIGH risk alert(s) on Camera (3 more rate-limited, recorded only)']
+
+    # Re-dispatching the same rows drops them as duplicates
+    assert alerts.dispatch(results, gate) == {}
+    assert len(get_alert_store()) == before + 5
+
+
+def test_rows_with_duplicate_index_labels_each_raise_an_alert(monkeypatch):
+    monkeypatch.setattr(alerts.st, 'error', lambda text: None)
+    monkeypatch.setattr(alerts, '_queue_emails', lambda records: None)
+    results = pd.DataFrame({
+        'Device': ['Camera', 'Light'],
+        'Packets': [1500, 1400],
+        'Timestamp': pd.date_range('2025-12-31', periods=2, freq='min'),
+        'Risk': ['HIGH', 'HIGH'],
+        'RiskScore': [90.0, 85.0],
+    }, index=[0, 0])
+    before = len(get_alert_store())
+
+    sent = alerts.dispatch(results, AlertGate())
+
+    assert sorted(sent) == [0, 1]
+    assert [sent[pos]['Device'] for pos in (0, 1)] == ['Camera', 'Light']
+    assert len(get_alert_store()) == before + 2
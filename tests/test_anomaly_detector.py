@@ -0,0 +1,219 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from anomaly_detector import (
+    AnomalyDetector,
+    ShardedDetector,
+    StatisticalDetector,
+    StreamingDetector,
+    compact_traffic,
+    detect_anomalies,
+    detect_anomalies_batch,
+    explain_anomalies_async,
+    make_detector,
+    memory_per_row,
+)
+
+
+def test_fitted_detector_scores_without_refit(make_traffic, tmp_path):
+    detector = AnomalyDetector().fit(make_traffic())
+    model = detector.model
+
+    results = detect_anomalies(make_traffic(15, seed=1), historical_df=make_traffic(), detector=detector)
+
+    assert detector.model is model
+    assert len(results) == 15
+    assert results['AnomalyScore'].between(0, 1).all()
+
+    path = tmp_path / 'detector.pkl'
+    detector.save(path)
+    restored = AnomalyDetector.load(path)
+    batch = results[['DeviceID', 'Packets', 'Z']]
+    np.testing.assert_allclose(restored.score(batch)[1], detector.score(batch)[1])
+
+
+def test_rule_explanations_and_context(make_traffic):
+    results = detect_anomalies(make_traffic())
+    spike = results.loc[results['Packets'].idxmax()]
+
+    assert spike['Explanation'].startswith('Unusually high packet transmission')
+    assert 'Abnormal traffic compared to other devices' in spike['Explanation']
+    assert spike['CyberContext'] == 'Possible DDoS or Flood'
+    assert set(results['Quarantine'][results['Risk'] == 'HIGH']) <= {'Yes'}
+    assert set(results['Quarantine'][results['Risk'] != 'HIGH']) <= {'No'}
+
+
+def test_streaming_detector_window_stays_bounded(make_traffic):
+    stream = StreamingDetector(window=100)
+    traffic = make_traffic(400)
+
+    for start in range(0, 400, 20):
+        results = stream.push(traffic.iloc[start:start + 20])
+        assert list(results.index) == list(range(start, start + 20))
+
+    window = stream.window_frame()
+    assert len(window) == 100
+    assert window['Timestamp'].is_monotonic_increasing
+    assert window['Timestamp'].iloc[-1] == traffic['Timestamp'].iloc[-1]
+
+
+def test_seeded_stream_scores_only_new_rows_against_history(make_traffic):
+    traffic = make_traffic(300)
+    history, batch = traffic.iloc[:285], traffic.iloc[285:]
+    detector = AnomalyDetector().fit(history)
+
+    seeded = StreamingDetector(window=1000, detector=detector)
+    seeded.seed(history)
+    replayed = StreamingDetector(window=1000, detector=detector)
+    replayed.push(history)
+
+    results = seeded.push(batch)
+    assert list(results.index) == list(batch.index)
+    pd.testing.assert_frame_equal(results, replayed.push(batch))
+
+
+def test_async_shap_reuses_cached_explainer(make_traffic):
+    detector = AnomalyDetector()
+    results = detect_anomalies(make_traffic(), detector=detector, explain=False)
+    assert (results['SHAP_Explanation'] == '').all()
+
+    shap_text = explain_anomalies_async(results, detector).result(timeout=60)
+    explainer = detector.explainer()
+
+    assert shap_text.index.equals(results.index)
+    assert (shap_text != '').sum() == min(10, (results['Anomaly'] == -1).sum())
+    assert detector.explainer() is explainer
+
+
+def test_sharded_detector_only_fits_new_shards(make_traffic):
+    detector = ShardedDetector(n_jobs=1)
+    results = detect_anomalies(make_traffic(), detector=detector, explain=False)
+    assert len(detector.models) == 3
+    assert results['AnomalyScore'].between(0, 1).all()
+
+    camera_model = detector.models[results.loc[results['Device'] == 'Camera', 'DeviceID'].iloc[0]]
+    extra = make_traffic(30, seed=2).assign(Device='Garage Door')
+    detect_anomalies(pd.concat([make_traffic(30, seed=3), extra], ignore_index=True), detector=detector, explain=False)
+
+    assert len(detector.models) == 4
+    assert camera_model in detector.models.values()
+
+
+def test_sharded_backend_skips_shap(make_traffic):
+    detector = ShardedDetector(n_jobs=1)
+    assert not detector.supports_shap
+    results = detect_anomalies(make_traffic(), detector=detector)
+    assert (results['SHAP_Explanation'] == '').all()
+
+    future = explain_anomalies_async(results, detector)
+    assert future.done() and (future.result() == '').all()
+
+
+def test_batch_matches_per_home_detection(make_traffic):
+    detector = AnomalyDetector().fit(make_traffic())
+    homes = {'north': make_traffic(120, seed=4), 'south': make_traffic(80, seed=5)}
+
+    results = detect_anomalies_batch(homes, detector=detector)
+
+    assert list(results['Home'].unique()) == ['north', 'south']
+    for home, frame in homes.items():
+        single = detect_anomalies(frame, detector=detector, explain=False)
+        batch = results[results['Home'] == home].reset_index(drop=True)
+        np.testing.assert_allclose(batch['BaselineMean'], single['BaselineMean'])
+        np.testing.assert_allclose(batch['RiskScore'], single['RiskScore'])
+        assert list(batch['Explanation']) == list(single['Explanation'])
+
+
+def test_results_use_compact_schema(make_traffic):
+    traffic = compact_traffic(make_traffic(1000))
+    results = detect_anomalies(traffic, explain=False)
+
+    assert traffic['Packets'].dtype == np.int32
+    assert isinstance(traffic['Device'].dtype, pd.CategoricalDtype)
+    assert results['RiskScore'].dtype == np.float32
+    assert results['Anomaly'].dtype == np.int8
+    assert memory_per_row(results) < 60
+
+
+def test_packets_beyond_int32_are_not_wrapped(make_traffic):
+    traffic = make_traffic(100)
+    traffic.loc[0, 'Packets'] = 3_000_000_000
+
+    with pytest.raises(ValueError):
+        compact_traffic(traffic)
+    results = detect_anomalies(traffic, explain=False)
+    assert results.loc[0, 'Packets'] == 3_000_000_000
+
+
+def test_statistical_backend_flags_spikes_with_same_columns(make_traffic, tmp_path):
+    traffic = make_traffic()
+    statistical = detect_anomalies(traffic, detector=make_detector('statistical'))
+    forest = detect_anomalies(traffic)
+
+    assert list(statistical.columns) == list(forest.columns)
+    spikes = statistical['Packets'] >= 800
+    assert (statistical.loc[spikes, 'Anomaly'] == -1).all()
+    assert (statistical.loc[spikes, 'Risk'] == 'HIGH').all()
+    assert (statistical['SHAP_Explanation'] == '').all()
+    assert not StatisticalDetector.supports_shap
+
+    detector = StatisticalDetector(adapt=False).fit(traffic)
+    path = tmp_path / 'statistical.pkl'
+    detector.save(path)
+    batch = statistical[['DeviceID', 'Packets', 'Z']]
+    np.testing.assert_allclose(StatisticalDetector.load(path).score(batch)[1], detector.score(batch)[1])
+
+
+def test_statistical_adapt_does_not_fold_training_rows_twice(make_traffic):
+    traffic = make_traffic()
+    adaptive = StatisticalDetector()
+    ids = np.unique(detect_anomalies(traffic, detector=adaptive)['DeviceID'])
+    seeded = StatisticalDetector(adapt=False).fit(traffic)
+    np.testing.assert_allclose(adaptive.ewma.lookup(ids)[0], seeded.ewma.lookup(ids)[0])
+
+    # Later batches are still folded in
+    before = adaptive.ewma.lookup(ids)[0]
+    adaptive.score(make_traffic(50, seed=5))
+    assert not np.allclose(adaptive.ewma.lookup(ids)[0], before)
+
+
+
+def test_streaming_statistical_fit_does_not_fold_the_batch_twice(make_traffic):
+    traffic = make_traffic()
+    spikes = traffic.tail(5).assign(Packets=5000)
+    streams = {}
+    for adapt in (True, False):
+        stream = StreamingDetector(detector=StatisticalDetector(alpha=0.5, adapt=adapt), refit_every=5)
+        stream.seed(traffic.head(195))
+        stream.push(spikes)
+        streams[adapt] = stream
+    ids = np.unique(streams[True].window_frame()['DeviceID'])
+
+    # Fitted on the window holding the spikes, so scoring them must not fold them in again
+    np.testing.assert_allclose(streams[True].detector.ewma.lookup(ids)[0], streams[False].detector.ewma.lookup(ids)[0])
+
+    # The next push refits (refit_every=5) and again folds the batch in only once
+    for stream in streams.values():
+        stream.push(spikes)
+    np.testing.assert_allclose(streams[True].detector.ewma.lookup(ids)[0], streams[False].detector.ewma.lookup(ids)[0])
+
+def test_batch_handles_empty_input():
+    detector = AnomalyDetector()
+
+    for empty in ({}, pd.DataFrame({'Home': [], 'Device': [], 'Packets': [], 'Timestamp': []})):
+        results = detect_anomalies_batch(empty, detector=detector)
+        assert len(results) == 0
+        assert {'Home', 'Risk', 'RiskScore', 'SHAP_Explanation'} <= set(results.columns)
+    assert not detector.is_fitted
+
+
+def test_batch_dict_key_replaces_existing_home_column(make_traffic):
+    detector = AnomalyDetector().fit(make_traffic())
+    north = make_traffic(120, seed=4).assign(Home='stale')
+
+    results = detect_anomalies_batch({'north': north}, detector=detector)
+
+    assert list(results.columns).count('Home') == 1
+    assert (results['Home'] == 'north').all()
+    assert len(results) == len(north)
@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+
+from baseline_store import BaselineStore
+
+
+def test_incremental_updates_match_full_groupby(make_traffic):
+    batches = [make_traffic(50, seed) for seed in range(5)]
+    store = BaselineStore()
+    for batch in batches:
+        store.update(batch)
+
+    expected = pd.concat(batches).groupby('Device')['Packets'].agg(['mean', 'std'])
+    got = store.baseline().set_index('Device').loc[expected.index]
+    np.testing.assert_allclose(got['BaselineMean'], expected['mean'])
+    np.testing.assert_allclose(got['BaselineStd'], expected['std'])
+
+
+def test_decay_tracks_recent_level():
+    store = BaselineStore(decay=0.9)
+    store.update(pd.DataFrame({'Device': ['Camera'] * 200, 'Packets': [100] * 200}))
+    store.update(pd.DataFrame({'Device': ['Camera'] * 200, 'Packets': [500] * 200}))
+
+    mean, _ = store.lookup(store.registry.ids(['Camera']))
+    assert mean[0] > 499
@@ -0,0 +1,13 @@
+from device_registry import DeviceRegistry
+
+
+def test_ids_are_stable_and_persisted(tmp_path):
+    path = tmp_path / 'devices.json'
+    registry = DeviceRegistry(path)
+    first = registry.ids(['Thermostat', 'Camera', 'Thermostat'])
+    registry.ids(['Smart Lock', 'Aardvark Sensor'])
+
+    reloaded = DeviceRegistry(path)
+    assert list(first) == [0, 1, 0]
+    assert list(reloaded.ids(['Camera', 'Aardvark Sensor', 'Thermostat'])) == [1, 3, 0]
+    assert list(reloaded.dtype.categories) == ['Thermostat', 'Camera', 'Smart Lock', 'Aardvark Sensor']
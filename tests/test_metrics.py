@@ -0,0 +1,61 @@
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    was_enabled = metrics.is_enabled()
+    metrics.reset()
+    yield
+    metrics.reset()
+    (metrics.enable if was_enabled else metrics.disable)()
+
+
+def test_disabled_metrics_record_nothing():
+    metrics.disable()
+    with metrics.timer("predict"):
+        pass
+    metrics.inc("rows_scored", 10)
+    assert metrics.snapshot() == {"stages": {}, "counters": {}}
+
+
+def test_timer_and_counters_render_as_prometheus_text():
+    metrics.enable()
+    with metrics.timer("predict"):
+        pass
+    metrics.observe("predict", 0.2)
+    metrics.inc("rows_scored", 100)
+    metrics.inc("alerts_raised", risk="HIGH")
+    metrics.inc("alerts_raised", risk="HIGH")
+
+    snap = metrics.snapshot()
+    assert snap["stages"]["predict"]["count"] == 2
+    assert snap["counters"] == {"rows_scored": 100, "alerts_raised{risk=HIGH}": 2}
+
+    text = metrics.render_prometheus()
+    assert '# TYPE shid_stage_latency_seconds histogram' in text
+    assert 'shid_stage_latency_seconds_bucket{stage="predict",le="+Inf"} 2' in text
+    assert 'shid_stage_latency_seconds_count{stage="predict"} 2' in text
+    assert 'shid_rows_scored_total 100' in text
+    assert 'shid_alerts_raised_total{risk="HIGH"} 2' in text
+
+
+def test_write_metrics(tmp_path):
+    metrics.enable()
+    metrics.inc("emails_sent")
+    path = tmp_path / "shid.prom"
+    metrics.write_metrics(str(path))
+    assert "shid_emails_sent_total 1" in path.read_text()
+
+
+@pytest.mark.parametrize("value, default, expected", [
+    (None, True, True), ("", False, False), ("1", False, True), ("Yes", False, True),
+    ("0", True, False), ("false", True, False), ("no", True, False),
+])
+def test_env_enabled_parses_metrics_enabled(monkeypatch, value, default, expected):
+    if value is None:
+        monkeypatch.delenv("METRICS_ENABLED", raising=False)
+    else:
+        monkeypatch.setenv("METRICS_ENABLED", value)
+    assert metrics.env_enabled(default=default) is expected
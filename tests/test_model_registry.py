@@ -0,0 +1,47 @@
+import threading
+import time
+
+from anomaly_detector import StatisticalDetector, StreamingDetector
+from model_registry import ModelRegistry, RWLock, SharedDetector
+
+
+def test_concurrent_sessions_train_one_model(make_traffic):
+    registry = ModelRegistry()
+    builds = []
+
+    def factory():
+        builds.append(1)
+        time.sleep(0.05)
+        return StatisticalDetector(adapt=False)
+
+    streams = [StreamingDetector(detector=SharedDetector(registry, 'home', factory)) for _ in range(8)]
+    threads = [threading.Thread(target=stream.push, args=(make_traffic(seed=i),)) for i, stream in enumerate(streams)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(builds) == 1 and len(registry) == 1
+    assert all(stream.detector.model is registry.get('home') for stream in streams)
+
+    # A retrain swaps the model in for every session
+    streams[0].detector.fit(make_traffic(seed=99))
+    assert len(builds) == 2
+    assert streams[1].detector.model is registry.get('home')
+
+
+def test_writer_waits_for_readers():
+    lock = RWLock()
+    events = []
+
+    def write():
+        with lock.write():
+            events.append('write')
+
+    with lock.read():
+        writer = threading.Thread(target=write)
+        writer.start()
+        time.sleep(0.05)
+        events.append('read done')
+    writer.join()
+    assert events == ['read done', 'write']
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from device_registry import DeviceRegistry
+from traffic_buffer import TrafficBuffer
+
+
+def _batch(n, start, seed=0):
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({
+        'Device': rng.choice(['Camera', 'Smart Lock', 'Thermostat'], n),
+        'Packets': rng.randint(100, 1500, n),
+        'Timestamp': pd.date_range('2025-12-29', periods=n, freq='s') + pd.Timedelta(minutes=start),
+    })
+
+
+def test_appends_match_concat_and_retention_is_capped():
+    buffer = TrafficBuffer(max_rows=500, registry=DeviceRegistry())
+    batches = [_batch(n, i, seed=i) for i, n in enumerate([30, 1, 700, 45, 260] * 20)]
+
+    for batch in batches:
+        buffer.append(batch)
+        assert len(buffer) <= 500
+        assert buffer.capacity <= 1024
+
+    expected = pd.concat(batches, ignore_index=True).tail(500)
+    frame = buffer.frame()
+    assert buffer.total_rows == sum(len(b) for b in batches)
+    assert frame.index.equals(expected.index)
+    assert (frame['Device'].astype(str).to_numpy() == expected['Device'].to_numpy()).all()
+    assert (frame['Packets'].to_numpy() == expected['Packets'].to_numpy()).all()
+    assert buffer.last_timestamp() == expected['Timestamp'].iloc[-1]
+    assert buffer.tail(20).index.equals(expected.tail(20).index)
+
+
+def test_frames_are_views_of_the_buffer():
+    buffer = TrafficBuffer(registry=DeviceRegistry())
+    buffer.append(_batch(2000, 0))
+
+    tail = buffer.tail(20)
+    assert np.shares_memory(tail['Packets'].to_numpy(), buffer.column('Packets'))
+    assert np.shares_memory(buffer.frame()['Timestamp'].to_numpy(), buffer.column('Timestamp'))
+    assert buffer.nbytes == 2000 * 16
+
+
+def test_packets_that_do_not_fit_int32_are_rejected():
+    buffer = TrafficBuffer(registry=DeviceRegistry())
+    batch = _batch(10, 0)
+
+    buffer.append(batch.assign(Packets=batch['Packets'].astype(float)))
+    assert (buffer.column('Packets') == batch['Packets'].to_numpy()).all()
+
+    with pytest.raises(ValueError):
+        buffer.append(batch.assign(Packets=batch['Packets'] + 0.5))
+    with pytest.raises(ValueError):
+        buffer.append(batch.assign(Packets=np.nan))
+    with pytest.raises(ValueError):
+        buffer.append(batch.assign(Packets=np.int64(3_000_000_000)))
+    assert len(buffer) == buffer.total_rows == 10
@@ -0,0 +1,23 @@
+import pandas as pd
+
+import worker
+from simulate_traffic import generate_traffic
+
+
+def test_worker_scores_csv_and_keeps_state(tmp_path):
+    traffic = tmp_path / 'traffic.csv'
+    generate_traffic(['Camera', 'Smart Lock'], n=120, n_anomalies=5, end=pd.Timestamp('2025-12-29')).to_csv(
+        traffic, index=False)
+    model, baseline, output = tmp_path / 'model.pkl', tmp_path / 'baseline.pkl', tmp_path / 'alerts.csv'
+
+    args = [str(traffic), '--backend', 'statistical', '--model', str(model), '--baseline', str(baseline)]
+    assert worker.main(args + ['--output', str(output), '--alerts-only']) == 0
+
+    alerts = pd.read_csv(output)
+    assert model.exists() and baseline.exists()
+    assert set(alerts['Risk']) <= {'MEDIUM', 'HIGH'}
+    assert (alerts['Packets'] >= 800).sum() == 5
+
+    # A second run reuses the saved detector and folds the batch into the stored baselines
+    assert worker.main(args + ['--output', str(tmp_path / 'all.csv')]) == 0
+    assert len(pd.read_csv(tmp_path / 'all.csv')) == 120
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+from device_registry import get_registry
+
+
+# Column dtypes (the compact traffic schema, with devices as registry IDs)
+DTYPES = {
+    'DeviceID': np.int32,
+    'Packets': np.int32,
+    'Timestamp': 'datetime64[ns]',
+}
+# Rows allocated by the first append
+MIN_CAPACITY = 1024
+
+
+def to_packets(values):
+    """Return Packets `values` as an int32 array.
+
+    Whole-number floats such as 12.0 are accepted; fractional, missing or
+    out-of-range values raise ValueError instead of being truncated or
+    wrapped around by the cast.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind not in 'iu':
+        values = values.astype(float)
+        if not np.array_equal(values, np.rint(values)):
+            raise ValueError("Packets must be whole numbers")
+    limits = np.iinfo(np.int32)
+    if len(values) and (values.min() < limits.min or values.max() > limits.max):
+        raise ValueError(f"Packets must be between {limits.min} and {limits.max}")
+    return values.astype(np.int32)
+
+
+class TrafficBuffer:
+    """Append-only columnar store of Device/Packets/Timestamp traffic.
+
+    Rows live in preallocated NumPy arrays that double in size when full, so
+    `append` costs amortized O(new rows) no matter how much traffic is
+    already held, where pd.concat copies the whole history every time.
+
+    With `max_rows` set only the newest `max_rows` rows are retained: the
+    arrays stop growing at twice that size, and once they fill up the
+    retained rows are moved back to the front (one copy of at most `max_rows`
+    rows per `max_rows` rows appended). Retained rows always form one
+    contiguous slice, so `column`, `frame` and `tail` return views rather
+    than copies. Views are only valid until the next `append`.
+    """
+
+    def __init__(self, max_rows=None, registry=None):
+        if max_rows is not None and max_rows < 1:
+            raise ValueError("max_rows must be at least 1")
+        self.max_rows = max_rows
+        self.registry = registry if registry is not None else get_registry()
+        # Rows ever appended, including those dropped by the retention cap
+        self.total_rows = 0
+        self._cols = {name: np.empty(0, dtype=dtype) for name, dtype in DTYPES.items()}
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def capacity(self):
+        return len(self._cols['DeviceID'])
+
+    @property
+    def nbytes(self):
+        """Bytes taken by the retained rows."""
+        return len(self) * sum(col.itemsize for col in self._cols.values())
+
+    def _reserve(self, n):
+        """Make room for `n` more rows after the retained ones."""
+        if self._end + n <= self.capacity:
+            return
+        size = len(self)
+        capacity = max(MIN_CAPACITY, 2 * (size + n))
+        if self.max_rows is not None:
+            capacity = min(capacity, 2 * self.max_rows)
+        if capacity <= self.capacity:
+            # Full at the retention limit: slide the retained rows to the front
+            for col in self._cols.values():
+                col[:size] = col[self._start:self._end]
+        else:
+            for name, col in self._cols.items():
+                grown = np.empty(capacity, dtype=col.dtype)
+                grown[:size] = col[self._start:self._end]
+                self._cols[name] = grown
+        self._start, self._end = 0, size
+
+    def append(self, df):
+        """Append the Device (or DeviceID) / Packets / Timestamp rows of `df`.
+
+        Packets are checked by to_packets, so values that do not fit int32
+        raise ValueError before anything is appended.
+        """
+        n = len(df)
+        if n == 0:
+            return
+        packets = to_packets(df['Packets'])
+        self.total_rows += n
+        if 'DeviceID' in df.columns:
+            ids = df['DeviceID'].to_numpy()
+        else:
+            ids = self.registry.categorical(df['Device']).codes
+        columns = {
+            'DeviceID': ids,
+            'Packets': packets,
+            'Timestamp': pd.to_datetime(df['Timestamp']).to_numpy(dtype='datetime64[ns]'),
+        }
+        if self.max_rows is not None:
+            # Rows that would be dropped straight away are never copied in
+            skip = max(0, n - self.max_rows)
+            columns = {name: values[skip:] for name, values in columns.items()}
+            n -= skip
+            self._start = max(self._start, self._end + n - self.max_rows)
+        self._reserve(n)
+        for name, values in columns.items():
+            self._cols[name][self._end:self._end + n] = values
+        self._end += n
+
+    def column(self, name, last=None):
+        """View of a column's retained values, oldest first (only the newest `last` if given)."""
+        start = self._start if last is None else max(self._start, self._end - last)
+        return self._cols[name][start:self._end]
+
+    def frame(self, last=None):
+        """Retained rows (or the newest `last`) as a compact Device/Packets/Timestamp DataFrame."""
+        ids = self.column('DeviceID', last)
+        # Index rows by their position in everything appended, as pd.concat(ignore_index=True) would
+        return pd.DataFrame({
+            'Device': self.registry.names_for(ids),
+            'Packets': self.column('Packets', last),
+            'Timestamp': self.column('Timestamp', last),
+        }, index=pd.RangeIndex(self.total_rows - len(ids), self.total_rows), copy=False)
+
+    def tail(self, n=5):
+        return self.frame(last=n)
+
+    def last_timestamp(self):
+        """Timestamp of the newest row (None if empty)."""
+        if len(self) == 0:
+            return None
+        return pd.Timestamp(self._cols['Timestamp'][self._end - 1])
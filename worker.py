@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Headless detection worker: score a traffic file without the dashboard.
+
+Reads Device, Packets and Timestamp rows from a CSV file (or stdin), runs
+detect_anomalies and writes the results as CSV. Streamlit is never imported,
+and scikit-learn / SHAP are only loaded if the chosen backend needs them:
+
+    python worker.py traffic.csv --backend statistical --alerts-only
+    python worker.py traffic.csv --model detector.pkl --baseline baseline.pkl --email
+
+--model and --baseline keep state between runs: a saved detector is loaded
+(or fitted on this batch and saved if the file does not exist yet) and the
+per-device baselines are updated and written back. --email sends MEDIUM/HIGH
+alerts using the SMTP_* / ALERT_TO environment variables.
+"""
+
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+import alerting
+from anomaly_detector import BACKENDS, detect_anomalies, make_detector
+from baseline_store import BaselineStore
+
+
+def load_detector(backend, path):
+    """Load the saved detector at `path`, or create a fresh one for `backend`."""
+    if path and os.path.exists(path):
+        return BACKENDS[backend].load(path)
+    return make_detector(backend)
+
+
+def email_alerts(results):
+    """Email every MEDIUM/HIGH row of `results`; return the number sent."""
+    cfg = alerting.resolve_smtp_config()
+    if cfg is None or not alerting.recipients(cfg):
+        print("SMTP_HOST / ALERT_TO not set; skipping email alerts", file=sys.stderr)
+        return 0
+    sent = 0
+    for row in results[results["Risk"] != "LOW"].itertuples(index=False):
+        record = alerting.make_record(row.Device, row.Packets, row.Risk, row.RiskScore, row.Explanation,
+                                      row.SHAP_Explanation or None, timestamp=str(row.Timestamp))
+        try:
+            alerting.send_email(cfg, record)
+            sent += 1
+        except Exception as e:
+            print(f"Failed to email alert for {row.Device}: {e}", file=sys.stderr)
+    return sent
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="traffic CSV with Device, Packets and Timestamp columns ('-' for stdin)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=os.getenv("DETECTOR_BACKEND", "isolation_forest"))
+    parser.add_argument("--model", help="saved detector to load, or to create from this batch")
+    parser.add_argument("--baseline", help="saved BaselineStore to update with this batch")
+    parser.add_argument("--output", default="-", help="results CSV ('-' for stdout)")
+    parser.add_argument("--alerts-only", action="store_true", help="only write MEDIUM/HIGH rows")
+    parser.add_argument("--explain", action="store_true", help="add SHAP explanations (isolation_forest only)")
+    parser.add_argument("--email", action="store_true", help="email MEDIUM/HIGH alerts")
+    args = parser.parse_args(argv)
+
+    traffic = pd.read_csv(sys.stdin if args.input == "-" else args.input, parse_dates=["Timestamp"])
+    detector = load_detector(args.backend, args.model)
+    baseline = None
+    if args.baseline:
+        baseline = BaselineStore.load(args.baseline) if os.path.exists(args.baseline) else BaselineStore()
+
+    results = detect_anomalies(traffic, detector=detector, baseline=baseline, explain=args.explain)
+
+    if args.model and not os.path.exists(args.model):
+        detector.save(args.model)
+    if baseline is not None:
+        baseline.save(args.baseline)
+
+    alerts = results[results["Risk"] != "LOW"]
+    (alerts if args.alerts_only else results).to_csv(sys.stdout if args.output == "-" else args.output, index=False)
+    print(f"{len(results)} rows scored, {len(alerts)} alerts", file=sys.stderr)
+    if args.email:
+        print(f"{email_alerts(results)} alert emails sent", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())